@@ -27,9 +27,11 @@ import sys
 import time
 import os
 import string
+import math
 import re
 import platform
 import shutil
+from collections import deque
 from datetime import datetime, timedelta
 from subprocess import call, Popen, PIPE
 import analyze_suspend as aslib
@@ -60,6 +62,8 @@ class SystemValues(aslib.SystemValues):
 	trace_cpufreq = False
 	trace_timer = False
 	trace_hrtimer = False
+	timerwindow = 1.0
+	timerstorm = 100.0
 	def __init__(self):
 		if('LOG_FILE' in os.environ and 'TEST_RESULTS_IDENTIFIER' in os.environ):
 			self.embedded = True
@@ -95,17 +99,21 @@ class Data(aslib.Data):
 	boottime = ''
 	phases = ['boot']
 	do_one_initcall = False
+	ws = None
+	wl = None
+	timer = None
+	hrtimer = None
 	def __init__(self, num):
 		self.testnumber = num
 		self.idstr = 'a'
 		self.dmesgtext = []
+		self.ws = aslib.WakeSourceStats('wakeup sources')
+		self.wl = aslib.WakeSourceStats('wakelocks')
+		self.timer = TimerStats('timers', sysvals.timerwindow, sysvals.timerstorm)
+		self.hrtimer = TimerStats('hrtimers', sysvals.timerwindow, sysvals.timerstorm)
 		self.dmesg = {
-			'wakesource': {'list': dict(), 'start': -1.0, 'end': -1.0, 'row': 0, 'color': '#dddddd'},
-			'wakelock': {'list': dict(), 'start': -1.0, 'end': -1.0, 'row': 0, 'color': '#dddddd'},
 			'cpuidle': {'list': dict(), 'start': -1.0, 'end': -1.0, 'row': 0, 'color': '#dddddd'},
 			'cpufreq': {'list': dict(), 'start': -1.0, 'end': -1.0, 'row': 0, 'color': '#dddddd'},
-			'timer': {'list': dict(), 'start': -1.0, 'end': -1.0, 'row': 0, 'color': '#dddddd'},
-			'hrtimer': {'list': dict(), 'start': -1.0, 'end': -1.0, 'row': 0, 'color': '#dddddd'},
 		}
 	def deviceTopology(self):
 		return ''
@@ -127,6 +135,113 @@ class Data(aslib.Data):
 			'ret': ret, 'ulen': ulen }
 		return name
 
+# Class: TimerStats
+# Description:
+#	 Expiration analysis of timer or hrtimer callbacks in one pass, with
+#	 memory bounded by the number of callbacks and timers rather than the
+#	 trace length. Expirations are grouped by callback function. Per
+#	 callback: the timers armed and expired, the interval between the
+#	 expirations of each timer as a running mean and variance (its period
+#	 and jitter), and the peak number in a sliding window. An expiration
+#	 that is the first thing to run on a cpu just after it left idle is a
+#	 wakeup, charged with the idle time it cut short. A callback whose peak
+#	 wakeup rate (or expiration rate, if no cpu_idle events were seen)
+#	 reaches the storm rate is flagged, as it keeps its cpus from staying
+#	 idle long enough to reach the deep states.
+class TimerStats:
+	def __init__(self, name, window=1.0, storm=100.0):
+		self.name = name
+		self.window = window
+		self.storm = storm
+		self.callbacks = dict()
+		self.timers = dict()
+		self.cpuidle = False
+		self.first = -1.0
+		self.last = -1.0
+		self.expires = 0
+		self.wakeups = 0
+	def callback(self, function):
+		if function not in self.callbacks:
+			self.callbacks[function] = {'function': function, 'armed': 0,
+				'expires': 0, 'timers': set(), 'cpus': set(), 'n': 0,
+				'mean': 0.0, 'm2': 0.0, 'recent': deque(), 'peak': 0,
+				'wakeups': 0, 'idle': 0.0, 'wrecent': deque(), 'wpeak': 0}
+		return self.callbacks[function]
+	def slide(self, q, ktime):
+		# the number of events in the window ending at ktime
+		q.append(ktime)
+		while q[0] <= ktime - self.window:
+			q.popleft()
+		return len(q)
+	def start(self, function):
+		self.callback(function)['armed'] += 1
+	def expire(self, timer, function, ktime, cpu, idle=-1.0):
+		if self.first < 0:
+			self.first = ktime
+		self.last = ktime
+		self.expires += 1
+		cb = self.callback(function)
+		cb['expires'] += 1
+		cb['timers'].add(timer)
+		cb['cpus'].add(cpu)
+		# running mean and variance of the intervals of each timer
+		key = (timer, function)
+		if key in self.timers:
+			dt = ktime - self.timers[key]
+			cb['n'] += 1
+			d = dt - cb['mean']
+			cb['mean'] += d / cb['n']
+			cb['m2'] += d * (dt - cb['mean'])
+		self.timers[key] = ktime
+		cb['peak'] = max(cb['peak'], self.slide(cb['recent'], ktime))
+		if idle >= 0:
+			self.wakeups += 1
+			cb['wakeups'] += 1
+			cb['idle'] += idle
+			cb['wpeak'] = max(cb['wpeak'], self.slide(cb['wrecent'], ktime))
+	def period(self, cb):
+		# the mean interval and its deviation, -1 if there were too few
+		if cb['n'] < 2:
+			return (-1.0, -1.0)
+		return (cb['mean'], math.sqrt(cb['m2'] / (cb['n'] - 1)))
+	def peakRate(self, cb):
+		peak = cb['wpeak'] if self.cpuidle else cb['peak']
+		return peak / self.window
+	def storms(self):
+		return [cb for cb in self.callbacks.values() \
+			if self.peakRate(cb) >= self.storm]
+	def top(self, count=20):
+		list = sorted(self.callbacks.values(), key=lambda cb:\
+			(self.peakRate(cb), cb['expires']), reverse=True)
+		return list[:count]
+	def printReport(self, count=20):
+		if not self.callbacks:
+			return
+		span = self.last - self.first
+		print('%s: %d callbacks, %d timers, %d expirations, %d wakeups in '\
+			'%.3f s, %d storms (%s >= %.0f/s in a %.3f s window)' % \
+			(self.name, len(self.callbacks), len(self.timers), self.expires,
+			self.wakeups, span, len(self.storms()),
+			'wakeups' if self.cpuidle else 'expirations', self.storm,
+			self.window))
+		print('%-32s %6s %8s %8s %8s %8s %10s %10s %8s %8s %10s' % \
+			('Callback', 'Timers', 'Armed', 'Expires', 'Rate/s', 'Peak/s',
+			'Period(ms)', 'Jitter(ms)', 'Wakeups', 'WakePk/s', 'Idle(ms)'))
+		for cb in self.top(count):
+			rate = cb['expires'] / span if span > 0 else 0.0
+			wrate = cb['wpeak'] / self.window
+			period, jitter = self.period(cb)
+			if period < 0:
+				period = jitter = '-'
+			else:
+				period, jitter = '%.3f' % (period * 1000), '%.3f' % (jitter * 1000)
+			idle = cb['idle'] * 1000 / cb['wakeups'] if cb['wakeups'] else 0.0
+			print('%-32s %6d %8d %8d %8.1f %8.1f %10s %10s %8d %8.1f %10.3f%s' % \
+				(cb['function'][:32], len(cb['timers']), cb['armed'],
+				cb['expires'], rate, cb['peak'] / self.window, period,
+				jitter, cb['wakeups'], wrate, idle,
+				' STORM' if self.peakRate(cb) >= self.storm else ''))
+
 # ----------------- FUNCTIONS --------------------
 
 def dumpFtraceData():
@@ -134,21 +249,16 @@ def dumpFtraceData():
 		for item in data.dmesg[phase]['list']:
 			print (phase, data.dmesg[phase]['list'][item], data.dmesg[phase]['list'][item]['name'], data.dmesg[phase]['list'][item]['start'], data.dmesg[phase]['list'][item]['end'])
 
-	print 
-	print data.dmesg['hrtimer']['list']
-
 
 # Function: parseFtraceLog
 # Description:
-#	 parse a kernel log for boot data
+#	 parse a kernel log for boot data. Each enabled trace type registers
+#	 its events with an aslib.TraceEventMatcher, which dispatches each
+#	 line to the handler of its event.
 def parseFtraceLog():
 	data = Data(0)
-	data.dmesg['wakesource']['start'] = data.start = ktime = 0.0
-	data.dmesg['wakelock']['start'] = data.start = ktime = 0.0
 	data.dmesg['cpuidle']['start'] = data.start = ktime = 0.0
 	data.dmesg['cpufreq']['start'] = data.start = ktime = 0.0
-	data.dmesg['timer']['start'] = data.start = ktime = 0.0
-	data.dmesg['hrtimer']['start'] = data.start = ktime = 0.0
 
 	sysvals.stamp = {
 		'time': datetime.now().strftime('%B %d %Y, %I:%M:%S %p'),
@@ -156,181 +266,153 @@ def parseFtraceLog():
 		'mode': 'boot', 'kernel': ''}
 
 	devtemp = dict()
+	idle = {'state': ''}
+	cur = {'cpu': '0'}
+	# when each cpu entered idle, and left it with the idle time it had
+	idlestart = dict()
+	woke = dict()
+	# a timer expiring this soon after its cpu left idle is what woke it
+	wakelat = 0.0005
+	def begin(phase, ktime, f):
+		if (data.start==0.0):
+			data.start = ktime
+		if (data.dmesg[phase]['start']==0.0):
+			data.dmesg[phase]['start'] = ktime
+		devtemp[f] = ktime
+	def end(phase, ktime, f, name):
+		data.valid = True
+		if(f in devtemp):
+			t = ktime - devtemp[f]
+			data.newAction(phase, name, devtemp[f], ktime, 0, int(t))
+			data.end = ktime
+			del devtemp[f]
+			return True
+		return False
+	# wakeup source and wakelock holds
+	def wsActivate(ktime, m):
+		if (data.start==0.0):
+			data.start = ktime
+		data.ws.acquire(m.group('f'), ktime)
+	def wsDeactivate(ktime, m):
+		data.valid = True
+		data.ws.release(m.group('f'), ktime)
+	def wakeLock(ktime, m):
+		if (data.start==0.0):
+			data.start = ktime
+		data.wl.acquire(m.group('f'), ktime)
+	def wakeUnlock(ktime, m):
+		data.valid = True
+		data.wl.release(m.group('f'), ktime)
+	def suspendResume(ktime, m):
+		name, state = m.group('name', 'state')
+		if name == 'suspend_enter' and state == 'begin':
+			data.ws.suspend(ktime, True)
+			data.wl.suspend(ktime, True)
+		elif name == 'thaw_processes' and state == 'end':
+			data.ws.suspend(ktime, False)
+			data.wl.suspend(ktime, False)
+	# cpuidle start/end processing
+	def cpuIdle(ktime, m):
+		f = m.group('f')
+		state = int(m.group('state'))
+		cpu = int(f)
+		data.timer.cpuidle = data.hrtimer.cpuidle = True
+		if state >= 0x80000000:
+			if cpu in idlestart:
+				woke[cpu] = (ktime, ktime - idlestart.pop(cpu))
+		else:
+			idlestart[cpu] = ktime
+			woke.pop(cpu, None)
+		if not sysvals.trace_cpuidle:
+			return
+		if state < 2:
+			idle['state'] = 'WFI' if state == 0 else 'POWEROFF'
+			begin('cpuidle', ktime, f)
+		else:
+			end('cpuidle', ktime, f, f+'-'+idle['state'])
+	# cpufreq processing
+	def cpuFrequency(ktime, m):
+		if (data.start==0.0):
+			data.start = ktime
+		if (data.dmesg['cpufreq']['start']==0.0):
+			data.dmesg['cpufreq']['start'] = ktime
+		t = 0.01
+		data.valid = True
+		data.newAction('cpufreq', m.group('f')+'-'+m.group('freq'),
+			ktime, ktime + t, 0, int(t))
+		data.dmesg['cpufreq']['end'] = ktime
+		data.end = ktime + t
+	# timer and hrtimer expirations, grouped by callback
+	def expire(stats, ktime, m):
+		if (data.start==0.0):
+			data.start = ktime
+		data.valid = True
+		cpu = int(cur['cpu'])
+		idle = -1.0
+		if cpu in woke:
+			t, cut = woke.pop(cpu)
+			if ktime - t <= wakelat:
+				idle = cut
+		stats.expire(m.group('f'), m.group('function'), ktime, cpu, idle)
+	def timerStart(ktime, m):
+		data.timer.start(m.group('function'))
+	def timerExpire(ktime, m):
+		expire(data.timer, ktime, m)
+	def hrtimerStart(ktime, m):
+		data.hrtimer.start(m.group('function'))
+	def hrtimerExpire(ktime, m):
+		expire(data.hrtimer, ktime, m)
+
+	em = aslib.TraceEventMatcher()
+	if (sysvals.trace_wakeup_source):
+		em.addEvent('wakeup_source_activate',
+			'^wakeup_source_activate: *(?P<f>.*) .*', wsActivate)
+		em.addEvent('wakeup_source_deactivate',
+			'^wakeup_source_deactivate: *(?P<f>.*) .*', wsDeactivate)
+	if (sysvals.trace_wakelock):
+		em.addEvent('pm_wake_lock', '^pm_wake_lock: *(?P<f>.*)', wakeLock)
+		em.addEvent('pm_wake_unlock', '^pm_wake_unlock: *(?P<f>.*)', wakeUnlock)
+	if (sysvals.trace_wakeup_source or sysvals.trace_wakelock):
+		em.addEvent('suspend_resume', '^suspend_resume: (?P<name>[a-z_]*)'+\
+			'\[[0-9]*\] (?P<state>begin|end)', suspendResume)
+	if (sysvals.trace_cpuidle or sysvals.trace_timer or sysvals.trace_hrtimer):
+		em.addEvent('cpu_idle',
+			'^cpu_idle: state=(?P<state>[0-9]*) *cpu_id=(?P<f>.*)', cpuIdle)
+	if (sysvals.trace_cpufreq):
+		em.addEvent('cpu_frequency',
+			'^cpu_frequency: state=(?P<freq>[0-9]*) *cpu_id=(?P<f>.*)', cpuFrequency)
+	if (sysvals.trace_timer):
+		em.addEvent('timer_start', '^timer_start: timer=(?P<f>[0-9a-f]*) '+\
+			'*function=(?P<function>[^ ]*) *expires=.*', timerStart)
+		em.addEvent('timer_expire_entry', '^timer_expire_entry: '+\
+			'timer=(?P<f>[0-9a-f]*) function=(?P<function>[^ ]*) now=.*', timerExpire)
+	if (sysvals.trace_hrtimer):
+		em.addEvent('hrtimer_start', '^hrtimer_start: hrtimer=(?P<f>[0-9a-f]*) '+\
+			'*function=(?P<function>[^ ]*) *expires=.*', hrtimerStart)
+		em.addEvent('hrtimer_expire_entry', '^hrtimer_expire_entry: '+\
+			'hrtimer=(?P<f>[0-9a-f]*) function=(?P<function>[^ ]*) now=.*', hrtimerExpire)
+
 	if(sysvals.ftracefile):
 		lf = open(sysvals.ftracefile, 'r')
 	else:
 		lf = Popen('dmesg', stdout=PIPE).stdout
 
-
 	for line in lf:
 		line = line.replace('\r\n', '')
 		line = line.replace('\n', '')
-
-		ftrace_line_fmt_nop = \
-		' *(?P<proc>.*)-(?P<pid>[0-9]*) *\[(?P<cpu>[0-9]*)\] *'+\
-		'(?P<flags>.{4}) *(?P<time>[0-9\.]*): *'+\
-		'(?P<msg>.*)'
-		m = re.match(ftrace_line_fmt_nop, line)
+		m = em.linefmt.match(line)
 		if(not m):
 			continue
-
-		proc = m.group('proc')
 		ktime = float(m.group('time'))
-		#if(ktime > 120):
-		#	break
-		msg = m.group('msg')
-
 		data.end = data.initstart = ktime
 		data.dmesgtext.append(line)
+		cur['cpu'] = m.group('cpu')
+		em.dispatch(ktime, m.group('msg'))
 
-	#Wakeup source processing
-		if (sysvals.trace_wakeup_source):
-			m = re.match('^wakeup_source_activate: *(?P<f>.*) .*', msg)
-			if(m):
-				if (data.start==0.0):
-					data.start = ktime
-				if (data.dmesg['wakesource']['start']==0.0):
-					data.dmesg['wakesource']['start'] = ktime
-				devtemp[m.group('f')] = ktime
-				continue
-
-			m = re.match('^wakeup_source_deactivate: *(?P<f>.*) .*', msg)
-			if(m):
-				data.valid = True
-				f = m.group('f')
-				r = 0
-				if(f in devtemp):
-					t = ktime - devtemp[m.group('f')]
-					data.newAction('wakesource', f, devtemp[f], ktime, int(r), int(t))
-					data.end = ktime
-					#print ('wakesource', f, str(devtemp[f])+'-'+str(ktime), str(t*1000000)+' us')
-					del devtemp[f]
-				continue
-	#Wakelock processing
-		if (sysvals.trace_wakelock):
-			m = re.match('^pm_wake_lock: *(?P<f>.*)', msg)
-			if(m):
-				if (data.start==0.0):
-					data.start = ktime
-				if (data.dmesg['wakelock']['start']==0.0):
-					data.dmesg['wakelock']['start'] = ktime
-				devtemp[m.group('f')] = ktime
-				continue
-			m = re.match('^pm_wake_unlock: *(?P<f>.*)', msg)
-			if(m):
-				data.valid = True
-				f = m.group('f')
-				r = 0
-				if(f in devtemp):
-					t = ktime - devtemp[m.group('f')]
-					data.newAction('wakelock', f, devtemp[f], ktime, int(r), int(t))
-					data.end = ktime
-					#print ('wakelock', f, str(devtemp[f])+'-'+str(ktime), str(t*1000000)+' us')
-					del devtemp[f]
-				continue
-	#Cpuidle start/end processing
-		if (sysvals.trace_cpuidle):
-			m = re.match('^cpu_idle: state=(?P<state>[0-9]*) *cpu_id=(?P<f>.*)', msg)
-			if(m):
-				if (data.start==0.0):
-					data.start = ktime
-				if (data.dmesg['cpuidle']['start']==0.0):
-					data.dmesg['cpuidle']['start'] = ktime
-				state = int(m.group('state'))
-				if state < 2:
-					if state == 0:
-						idle_state = 'WFI'
-					elif state == 1:
-						idle_state = 'POWEROFF'
-					devtemp[m.group('f')] = ktime
-					#print (m.group('f'), idle_state, 'start')
-					continue
-				else:
-					data.valid = True
-					f = m.group('f')
-					r = 0
-					if(f in devtemp):
-						t = ktime - devtemp[m.group('f')]
-						#print ('cpuidle', f,idle_state, str(devtemp[f])+'-'+str(ktime), str(t*1000000)+' us')
-						data.newAction('cpuidle', f+'-'+idle_state, devtemp[f], ktime, int(r), int(t))
-						data.end = ktime
-						del devtemp[f]
-					continue
-	#cpufreq processing
-		if (sysvals.trace_cpufreq):
-			m = re.match('^cpu_frequency: state=(?P<freq>[0-9]*) *cpu_id=(?P<f>.*)', msg)
-			if(m):
-				if (data.start==0.0):
-					data.start = ktime
-				if (data.dmesg['cpufreq']['start']==0.0):
-					data.dmesg['cpufreq']['start'] = ktime
-				r = 0
-				t = 0.01
-				f = m.group('f')
-				freq = m.group('freq')
-				data.valid = True
-				data.newAction('cpufreq', f+'-'+freq, ktime, ktime + t, int(r), int(t))
-				#print ('cpufreq', f, freq, ktime)
-				data.dmesg['cpufreq']['end'] = ktime
-				data.end = ktime + t
-	#timer processing
-		if (sysvals.trace_timer):
-			m = re.match('^timer_start: timer=(?P<f>[0-9a-f]*) *function=(?P<function>.*) *expires=.*', msg)
-			if(m):
-				if (data.start==0.0):
-					data.start = ktime
-				if (data.dmesg['timer']['start']==0.0):
-					data.dmesg['timer']['start'] = ktime
-				devtemp[m.group('f')] = ktime
-				continue
-
-			m = re.match('^timer_expire_entry: timer=(?P<f>[0-9a-f]*) function=(?P<function>.*) now=.*', msg)
-			if(m):
-				data.valid = True
-				f = m.group('f')
-				function = m.group('function')
-				r = 0
-				if(f in devtemp):
-					t = ktime - devtemp[m.group('f')]
-					data.newAction('timer', f, devtemp[f], ktime, int(r), int(t))
-					data.dmesg['timer']['end'] = ktime
-					data.end = ktime
-					print ('timer', f, function)
-					del devtemp[f]
-				continue
-
-	#hrtimer processing
-		if (sysvals.trace_hrtimer):
-			m = re.match('^hrtimer_start: hrtimer=(?P<f>[0-9a-f]*) *function=(?P<function>.*) *expires=.*', msg)
-			if(m):
-				if (data.start==0.0):
-					data.start = ktime
-				if (data.dmesg['hrtimer']['start']==0.0):
-					data.dmesg['hrtimer']['start'] = ktime
-				devtemp[m.group('f')] = ktime
-				continue
-
-			m = re.match('^hrtimer_expire_entry: hrtimer=(?P<f>[0-9a-f]*) function=(?P<function>.*) now=.*', msg)
-			if(m):
-				data.valid = True
-				f = m.group('f')
-				function = m.group('function')
-				r = 0
-				if(f in devtemp):
-					t = ktime - devtemp[m.group('f')]
-					data.newAction('hrtimer', f, devtemp[f], ktime, int(r), int(t))
-					data.dmesg['hrtimer']['end'] = ktime
-					data.end = ktime
-					print ('hrtimer', f, function)
-					del devtemp[f]
-				continue
-
-	data.dmesg['wakesource']['end'] = data.end
-	data.dmesg['wakelock']['end'] = data.end
+	data.ws.finish(data.end)
+	data.wl.finish(data.end)
 	data.dmesg['cpuidle']['end'] = data.end
 	data.dmesg['cpufreq']['end'] = data.end
-	data.dmesg['timer']['end'] = data.end
-	data.dmesg['hrtimer']['end'] = data.end
 
 	lf.close()
 	return data
@@ -362,6 +444,10 @@ def printHelp():
 	print('  -h            Print this help text')
 	print('  -v            Print the current tool version')
 	print('  -ftrace file  Load a stored ftrace file (used with -dmesg)')
+	print('  -timer        Summarize timer expirations by callback')
+	print('  -hrtimer      Summarize hrtimer expirations by callback')
+	print('  -timerwindow sec  Sliding window for the timer peak rates (default: 1.0)')
+	print('  -timerstorm rate  Peak wakeups/s that flag a timer storm (default: 100)')
 	print('')
 	return True
 
@@ -391,6 +477,10 @@ if __name__ == '__main__':
 			sysvals.trace_timer = True
 		elif(arg == '-hrtimer'):
 			sysvals.trace_hrtimer = True
+		elif(arg == '-timerwindow'):
+			sysvals.timerwindow = aslib.getArgFloat('-timerwindow', args, 0.001, 3600.0)
+		elif(arg == '-timerstorm'):
+			sysvals.timerstorm = aslib.getArgFloat('-timerstorm', args, 1.0, 1000000.0)
 		elif(arg == '-ftrace'):
 			try:
 				val = args.next()
@@ -410,6 +500,10 @@ if __name__ == '__main__':
 		doError('ftrace file required')
 
 	dumpFtraceData()
+	data.ws.printReport()
+	data.wl.printReport()
+	data.timer.printReport()
+	data.hrtimer.printReport()
 
 	print('          Host: %s' % sysvals.hostname)
 	print('     Test time: %s' % sysvals.testtime)
@@ -32,6 +32,7 @@ import platform
 import shutil
 from datetime import datetime, timedelta
 from subprocess import call, Popen, PIPE
+from array import array
 import analyze_suspend as aslib
 
 # ----------------- CLASSES --------------------
@@ -131,6 +132,98 @@ class SystemValues(aslib.SystemValues):
 
 sysvals = SystemValues()
 
+# Class: CpuResidency
+# Description:
+#	 The per cpu state timelines of one cpu event type (cpu_idle states or
+#	 cpu_frequency values), built in one pass. Each cpu keeps its current
+#	 state and when it began, the time spent in and number of entries to
+#	 each state, and a run-length encoded strip: parallel arrays of the
+#	 times the state changed and the new state, with repeats dropped.
+class CpuResidency:
+	def __init__(self, name):
+		self.name = name
+		self.cpus = dict()
+	def change(self, cpu, ktime, state):
+		if cpu not in self.cpus:
+			self.cpus[cpu] = {'state': state, 'time': ktime, 'end': ktime,
+				'residency': {state: 0.0}, 'entries': {state: 1}, 'trans': 0,
+				'times': array('d', [ktime]), 'states': array('l', [state])}
+			return
+		c = self.cpus[cpu]
+		if state == c['state']:
+			return
+		c['residency'][c['state']] += ktime - c['time']
+		if state not in c['residency']:
+			c['residency'][state] = 0.0
+			c['entries'][state] = 0
+		c['entries'][state] += 1
+		c['trans'] += 1
+		c['state'], c['time'] = state, ktime
+		c['times'].append(ktime)
+		c['states'].append(state)
+	def finish(self, ktime):
+		# close the current state of every cpu at the end of the trace
+		for c in self.cpus.values():
+			c['residency'][c['state']] += ktime - c['time']
+			c['time'] = c['end'] = ktime
+	def states(self):
+		out = set()
+		for c in self.cpus.values():
+			out |= set(c['residency'])
+		return sorted(out)
+	def label(self, state):
+		if self.name == 'idle':
+			return 'run' if state < 0 else 'C%d' % state
+		return '%d MHz' % (state / 1000)
+	def strip(self, cpu, t0, tMax, bins):
+		# the strip resampled to bins equal slots, each slot taking the
+		# state it spent the most time in, then merged into segments of
+		# (start slot, slot count, state) so the html has <= bins divs
+		c = self.cpus[cpu]
+		times, states = c['times'], c['states']
+		width = (tMax - t0) / bins
+		if width <= 0:
+			return []
+		slots = [dict() for i in range(bins)]
+		for i in range(len(times)):
+			s = times[i]
+			e = times[i+1] if i+1 < len(times) else c['end']
+			st = states[i]
+			b = max(int((s - t0) / width), 0)
+			while b < bins and s < e:
+				be = min(t0 + (b + 1) * width, e)
+				slots[b][st] = slots[b].get(st, 0.0) + be - s
+				s = be
+				b += 1
+		out = []
+		for b in range(bins):
+			if not slots[b]:
+				continue
+			st = max(slots[b], key=slots[b].get)
+			if out and out[-1][2] == st and out[-1][0] + out[-1][1] == b:
+				out[-1][1] += 1
+			else:
+				out.append([b, 1, st])
+		return out
+	def color(self, state, states):
+		# idle: running is red, deeper states are darker blues,
+		# freq: low to high runs green to red
+		if self.name == 'idle':
+			if state < 0:
+				return 'hsl(0,70%,60%)'
+			return 'hsl(220,60%%,%d%%)' % max(80 - 10 * state, 25)
+		i = states.index(state)
+		return 'hsl(%d,70%%,55%%)' % (120 - 120 * i / max(len(states) - 1, 1))
+	def printStats(self):
+		for cpu in sorted(self.cpus, key=int):
+			c = self.cpus[cpu]
+			total = sum(c['residency'].values())
+			print('%s cpu%s: %d transitions' % (self.name, cpu, c['trans']))
+			for st in sorted(c['residency']):
+				pct = 100.0 * c['residency'][st] / total if total > 0 else 0.0
+				print('  %10s %6.2f%% %12.3f ms %8d entries' % (self.label(st),
+					pct, c['residency'][st] * 1000, c['entries'][st]))
+
 # Class: Data
 # Description:
 #	 The primary container for test data.
@@ -138,7 +231,6 @@ class Data(aslib.Data):
 	dmesg = {}  # root data structure
 	start = 0.0 # test start
 	end = 0.0   # test end
-	dmesgtext = []   # dmesg text file in memory
 	testnumber = 0
 	idstr = ''
 	html_device_id = 0
@@ -147,10 +239,17 @@ class Data(aslib.Data):
 	boottime = ''
 	phases = ['boot']
 	do_one_initcall = False
+	idle = None
+	freq = None
+	ws = None
+	wl = None
 	def __init__(self, num):
 		self.testnumber = num
 		self.idstr = 'a'
-		self.dmesgtext = []
+		self.idle = CpuResidency('idle')
+		self.freq = CpuResidency('freq')
+		self.ws = aslib.WakeSourceStats('wakeup sources')
+		self.wl = aslib.WakeSourceStats('wakelocks')
 		self.dmesg = {
 			'boot': {'list': dict(), 'start': -1.0, 'end': -1.0, 'row': 0, 'color': '#dddddd'}
 		}
@@ -196,7 +295,9 @@ class Data(aslib.Data):
 
 # Function: parseFtraceLog
 # Description:
-#	 parse a kernel log for boot data
+#	 parse a kernel log for boot data. Each enabled trace type registers
+#	 its events with an aslib.TraceEventMatcher, which dispatches each
+#	 line to the handler of its event.
 def parseFtraceLog():
 	data = Data(0)
 	data.dmesg['boot']['start'] = data.start = ktime = 0.0
@@ -206,128 +307,80 @@ def parseFtraceLog():
 		'mode': 'boot', 'kernel': ''}
 
 	tp = aslib.TestProps()
-	devtemp = dict()
+	def first(ktime):
+		if (data.dmesg['boot']['start']==0.0):
+			data.dmesg['boot']['start'] = data.start = ktime
+	# wakeup source and wakelock holds
+	def wsActivate(ktime, m):
+		first(ktime)
+		data.ws.acquire(m.group('f'), ktime)
+	def wsDeactivate(ktime, m):
+		data.valid = True
+		data.ws.release(m.group('f'), ktime)
+	def wakeLock(ktime, m):
+		first(ktime)
+		data.wl.acquire(m.group('f'), ktime)
+	def wakeUnlock(ktime, m):
+		data.valid = True
+		data.wl.release(m.group('f'), ktime)
+	def suspendResume(ktime, m):
+		name, state = m.group('name', 'state')
+		if name == 'suspend_enter' and state == 'begin':
+			data.ws.suspend(ktime, True)
+			data.wl.suspend(ktime, True)
+		elif name == 'thaw_processes' and state == 'end':
+			data.ws.suspend(ktime, False)
+			data.wl.suspend(ktime, False)
+	# cpuidle and cpufreq residency, the idle exit state is (u32)-1
+	def cpuIdle(ktime, m):
+		first(ktime)
+		data.valid = True
+		state = int(m.group('state'))
+		if state >= 0x80000000:
+			state = -1
+		data.idle.change(m.group('cpu'), ktime, state)
+	def cpuFrequency(ktime, m):
+		first(ktime)
+		data.valid = True
+		data.freq.change(m.group('cpu'), ktime, int(m.group('freq')))
+
+	em = aslib.TraceEventMatcher()
+	if (sysvals.trace_wakeup_source):
+		em.addEvent('wakeup_source_activate',
+			'^wakeup_source_activate: *(?P<f>.*) .*', wsActivate)
+		em.addEvent('wakeup_source_deactivate',
+			'^wakeup_source_deactivate: *(?P<f>.*) .*', wsDeactivate)
+	if (sysvals.trace_wakelock):
+		em.addEvent('pm_wake_lock', '^pm_wake_lock: *(?P<f>.*)', wakeLock)
+		em.addEvent('pm_wake_unlock', '^pm_wake_unlock: *(?P<f>.*)', wakeUnlock)
+	if (sysvals.trace_wakeup_source or sysvals.trace_wakelock):
+		em.addEvent('suspend_resume', '^suspend_resume: (?P<name>[a-z_]*)'+\
+			'\[[0-9]*\] (?P<state>begin|end)', suspendResume)
+	if (sysvals.trace_cpuidle):
+		em.addEvent('cpu_idle', '^cpu_idle: state=(?P<state>[0-9]*) '+\
+			'*cpu_id=(?P<cpu>[0-9]*)', cpuIdle)
+	if (sysvals.trace_cpufreq):
+		em.addEvent('cpu_frequency', '^cpu_frequency: state=(?P<freq>[0-9]*) '+\
+			'*cpu_id=(?P<cpu>[0-9]*)', cpuFrequency)
+
 	if(sysvals.ftracefile):
 		lf = open(sysvals.ftracefile, 'r')
 	else:
 		lf = Popen('dmesg', stdout=PIPE).stdout
 
-
 	for line in lf:
 		line = line.replace('\r\n', '')
 		line = line.replace('\n', '')
-		# grab the stamp and sysinfo
-#		if re.match(tp.stampfmt, line):
-#			tp.stamp = line
-#			continue
-#		elif re.match(tp.sysinfofmt, line):
-#			tp.sysinfo = line
-#			continue
-#		idx = line.find('[')
-#		if idx > 1:
-#			line = line[idx:]
-#		m = re.match('[ \t]*(\[ *)(?P<ktime>[0-9\.]*)(\]) (?P<msg>.*)', line)
-		ftrace_line_fmt_nop = \
-		' *(?P<proc>.*)-(?P<pid>[0-9]*) *\[(?P<cpu>[0-9]*)\] *'+\
-		'(?P<flags>.{4}) *(?P<time>[0-9\.]*): *'+\
-		'(?P<msg>.*)'
-		m = re.match(ftrace_line_fmt_nop, line)
+		m = em.linefmt.match(line)
 		if(not m):
 			continue
-
-		proc = m.group('proc')
 		ktime = float(m.group('time'))
-		#if(ktime > 120):
-		#	break
-		msg = m.group('msg')
-
 		data.end = data.initstart = ktime
-		data.dmesgtext.append(line)
-		#if(ktime == 0.0 and re.match('^Linux version .*', msg)):
-		#	if(not sysvals.stamp['kernel']):
-		#		sysvals.stamp['kernel'] = sysvals.kernelVersion(msg)
-		#	continue
-	#Wakeup source processing
-		if (sysvals.trace_wakeup_source):
-			#m = re.match('^calling *(?P<f>.*)\+.*', msg)
-			m = re.match('^wakeup_source_activate: *(?P<f>.*) .*', msg)
-			if(m):
-				if (data.dmesg['boot']['start']==0.0):
-					data.dmesg['boot']['start'] = data.start = ktime
-				devtemp[m.group('f')] = ktime
-				continue
-			#m = re.match('^initcall *(?P<f>.*)\+.* returned (?P<r>.*) after (?P<t>.*) usecs', msg)
-			m = re.match('^wakeup_source_deactivate: *(?P<f>.*) .*', msg)
-			if(m):
-				data.valid = True
-				f = m.group('f')
-				r = 0
-				if(f in devtemp):
-					t = ktime - devtemp[m.group('f')]
-					data.newAction('boot', 'ws-'+f, devtemp[f], ktime, int(r), int(t))
-					data.end = ktime
-					del devtemp[f]
-				continue
-	#Wakelock processing
-		if (sysvals.trace_wakelock):
-			m = re.match('^pm_wake_lock: *(?P<f>.*)', msg)
-			if(m):
-				if (data.dmesg['boot']['start']==0.0):
-					data.dmesg['boot']['start'] = data.start = ktime
-				devtemp[m.group('f')] = ktime
-				continue
-			m = re.match('^pm_wake_unlock: *(?P<f>.*)', msg)
-			if(m):
-				data.valid = True
-				f = m.group('f')
-				r = 0
-				if(f in devtemp):
-					t = ktime - devtemp[m.group('f')]
-					data.newAction('boot', 'wl-'+f, devtemp[f], ktime, int(r), int(t))
-					data.end = ktime
-					print (f, str(devtemp[f])+'-'+str(ktime))
-					del devtemp[f]
-				continue
-	#Cpuidle start/end processing
-		if (sysvals.trace_cpuidle):
-			m = re.match('^cpu_idle: state=(?P<state>[0-9]*) *(?P<f>.*)', msg)
-			if(m):
-				if (data.dmesg['boot']['start']==0.0):
-					data.dmesg['boot']['start'] = data.start = ktime
-				state = int(m.group('state'))
-				if state < 2:
-					if state == 0:
-						idle_state = 'WFI'
-					elif state == 1:
-						idle_state = 'POWEROFF'
-					devtemp[m.group('f')] = ktime
-					#print (m.group('f'), idle_state, 'start')
-					continue
-				else:
-					data.valid = True
-					f = m.group('f')
-					r = 0
-					if(f in devtemp):
-						t = ktime - devtemp[m.group('f')]
-						#print (f,idle_state, 'end')
-						data.newAction('boot', 'idle-'+f+'-'+idle_state, devtemp[f], ktime, int(r), int(t))
-						data.end = ktime
-						del devtemp[f]
-					continue
-	#cpufreq processing
-		if (sysvals.trace_cpufreq):
-			m = re.match('^cpu_frequency: state=(?P<freq>[0-9]*) *(?P<f>.*)', msg)
-			if(m):
-				if (data.dmesg['boot']['start']==0.0):
-					data.dmesg['boot']['start'] = data.start = ktime
-				r = 0
-				t = 0.01
-				f = m.group('f')
-				freq = m.group('freq')
-				data.valid = True
-				data.newAction('boot', 'cf-'+f+'-'+freq, ktime, ktime + t, int(r), int(t))
-				print (f, freq, ktime)
-				data.end = ktime + t
+		em.dispatch(ktime, m.group('msg'))
+	data.idle.finish(data.end)
+	data.freq.finish(data.end)
+	data.ws.finish(data.end)
+	data.wl.finish(data.end)
 	if tp.stamp:
 		sysvals.stamp = 0
 		tp.parseStamp(data, sysvals)
@@ -408,7 +461,7 @@ def createBootGraph(data):
 	devtl = aslib.Timeline(100, 20)
 
 	# write the test title and general info header
-	devtl.createHeader(sysvals)
+	devtl.createHeader(sysvals, sysvals.stamp)
 
 	# Generate the header for this timeline
 	t0 = data.start
@@ -517,12 +570,21 @@ def createBootGraph(data):
 		.fstat th {width:55px;}\n\
 		.fstat td {text-align:left;width:35px;}\n\
 		.srccall {position:absolute;font-size:10px;z-index:7;overflow:hidden;color:black;text-align:center;white-space:nowrap;border-radius:5px;border:1px solid black;background:linear-gradient(to bottom right,#CCC,#969696);}\n\
-		.srccall:hover {color:white;font-weight:bold;border:1px solid white;}\n'
+		.srccall:hover {color:white;font-weight:bold;border:1px solid white;}\n\
+		.cpurow {position:relative;height:16px;margin:2px 0;}\n\
+		.cpuname {position:absolute;left:0;width:100px;font:12px Arial;line-height:16px;}\n\
+		.cpustrip {position:absolute;left:100px;right:0;height:16px;background:#eee;}\n\
+		.cpuseg {position:absolute;height:16px;}\n\
+		table.cpures {border-collapse:collapse;margin:10px 0;font:12px Arial;}\n\
+		.cpures td, .cpures th {border:1px solid #888;padding:2px 6px;text-align:right;}\n'
 	if(not sysvals.embedded):
 		aslib.addCSS(hf, sysvals, 1, False, extra)
 
-	# write the device timeline
+	# write the device timeline and the cpu idle/freq strips
 	hf.write(devtl.html)
+	cpuResidencyHTML(hf, data, t0, tMax)
+	wakeSourceHTML(hf, data.ws, t0, tMax)
+	wakeSourceHTML(hf, data.wl, t0, tMax)
 
 	# add boot specific html
 	statinfo = 'var devstats = {\n'
@@ -550,13 +612,9 @@ def createBootGraph(data):
 	if(sysvals.usecallgraph):
 		aslib.addCallgraphs(sysvals, hf, data)
 
-	# add the dmesg log as a hidden div
-	if sysvals.dmesglog:
-		hf.write('<div id="dmesglog" style="display:none;">\n')
-		for line in data.dmesgtext:
-			line = line.replace('<', '&lt').replace('>', '&gt')
-			hf.write(line)
-		hf.write('</div>\n')
+	# add the trace log as a hidden div
+	if sysvals.dmesglog and sysvals.ftracefile:
+		aslib.addLogHTML(sysvals, hf, 'dmesglog', sysvals.ftracefile)
 
 	if(not sysvals.embedded):
 		# write the footer and close
@@ -569,6 +627,85 @@ def createBootGraph(data):
 	hf.close()
 	return True
 
+# Function: cpuResidencyHTML
+# Description:
+#	 Write one strip per cpu for each of the idle and frequency timelines,
+#	 resampled to at most bins segments each, with a table per timeline
+#	 of the time in each state, its entries, and the transitions per cpu
+# Arguments:
+#	 hf: the open html file
+#	 data: the Data object with the idle and freq CpuResidency
+#	 t0, tMax: the timeline start and end
+def cpuResidencyHTML(hf, data, t0, tMax, bins=1000):
+	html_seg = '<div class="cpuseg" style="left:{0:.3f}%;width:{1:.3f}%;background:{2}" title="{3}"></div>'
+	for res in [data.idle, data.freq]:
+		if not res.cpus:
+			continue
+		states = res.states()
+		cpus = sorted(res.cpus, key=int)
+		hf.write('<div class="cpures">\n')
+		for cpu in cpus:
+			hf.write('<div class="cpurow"><div class="cpuname">cpu%s %s</div>'\
+				'<div class="cpustrip">' % (cpu, res.name))
+			for b, n, st in res.strip(cpu, t0, tMax, bins):
+				hf.write(html_seg.format(100.0 * b / bins, 100.0 * n / bins,
+					res.color(st, states), res.label(st)))
+			hf.write('</div></div>\n')
+		hf.write('<table class="cpures">\n<tr><th>%s</th>' % res.name)
+		for st in states:
+			hf.write('<th style="background:%s">%s</th>' % \
+				(res.color(st, states), res.label(st)))
+		hf.write('<th>transitions</th></tr>\n')
+		for cpu in cpus:
+			c = res.cpus[cpu]
+			total = sum(c['residency'].values())
+			hf.write('<tr><td>cpu%s</td>' % cpu)
+			for st in states:
+				if st not in c['residency'] or total <= 0:
+					hf.write('<td></td>')
+					continue
+				hf.write('<td>%.2f%% (%d)</td>' % \
+					(100.0 * c['residency'][st] / total, c['entries'][st]))
+			hf.write('<td>%d</td></tr>\n' % c['trans'])
+		hf.write('</table>\n</div>\n')
+
+# Function: wakeSourceHTML
+# Description:
+#	 Write a strip of the holds of each of the top sources by total hold
+#	 time, resampled to at most bins segments each, and a table of their
+#	 hold and contention stats. The whole strip of a source is red if it
+#	 was ever acquired during a suspend, blue otherwise.
+# Arguments:
+#	 hf: the open html file
+#	 ws: the aslib.WakeSourceStats object
+#	 t0, tMax: the timeline start and end
+#	 count: the number of sources to show
+def wakeSourceHTML(hf, ws, t0, tMax, bins=1000, count=20):
+	if not ws.sources:
+		return
+	html_seg = '<div class="cpuseg" style="left:{0:.3f}%;width:{1:.3f}%;background:{2}"></div>'
+	top = ws.top(count)
+	hf.write('<div class="cpures">\n')
+	for s in top:
+		hf.write('<div class="cpurow" title="%s"><div class="cpuname">%s</div>'\
+			'<div class="cpustrip">' % (s['name'], s['name'][:14]))
+		for b, n in ws.strip(s['name'], t0, tMax, bins):
+			hf.write(html_seg.format(100.0 * b / bins, 100.0 * n / bins,
+				'rgba(209,0,0,0.6)' if s['insuspend'] else 'rgba(17,51,204,0.6)'))
+		hf.write('</div></div>\n')
+	hf.write('<table class="cpures">\n<tr><th>%s (%d)</th>' % \
+		(ws.name, len(ws.sources)))
+	for h in ['holds', 'acquires', 'total ms', 'max ms', 'alone ms',
+		'held at suspend', 'acquired in suspend']:
+		hf.write('<th>%s</th>' % h)
+	hf.write('</tr>\n')
+	for s in top:
+		hf.write('<tr><td>%s</td><td>%d</td><td>%d</td><td>%.3f</td><td>%.3f</td>'\
+			'<td>%.3f</td><td>%d</td><td>%d</td></tr>\n' % (s['name'], s['holds'],
+			s['acquires'], s['total'] * 1000, s['max'] * 1000,
+			s['exclusive'] * 1000, s['atsuspend'], s['insuspend']))
+	hf.write('</table>\n</div>\n')
+
 # Function: updateCron
 # Description:
 #    (restore=False) Set the tool to run automatically on reboot
@@ -723,6 +860,8 @@ def printHelp():
 	print('  -h            Print this help text')
 	print('  -v            Print the current tool version')
 	print('  -addlogs      Add the dmesg log to the html output')
+	print('  -wakesource   Add the wakeup sources to the timeline')
+	print('  -cpuidle      Add per cpu idle state strips and residency (cpufreq is on by default)')
 	print('  -o name       Overrides the output subdirectory name when running a new test')
 	print('                default: boot-{date}-{time}')
 	print(' [advanced]')
@@ -761,6 +900,10 @@ if __name__ == '__main__':
 			cmd = arg[1:]
 		elif(arg == '-f'):
 			sysvals.useftrace = True
+		elif(arg == '-wakesource'):
+			sysvals.trace_wakeup_source = True
+		elif(arg == '-cpuidle'):
+			sysvals.trace_cpuidle = True
 		elif(arg == '-callgraph'):
 			sysvals.useftrace = True
 			sysvals.usecallgraph = True
@@ -866,6 +1009,10 @@ if __name__ == '__main__':
 	print('Kernel Version: %s' % sysvals.kernel)
 	print(' Measure start: %.3f' % (data.start * 1000))
 	print('   Measure end: %.3f' % (data.initstart * 1000))
+	data.idle.printStats()
+	data.freq.printStats()
+	data.ws.printReport()
+	data.wl.printReport()
 
 	# handle embedded output logs
 	if(sysvals.outfile and sysvals.embedded):
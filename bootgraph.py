@@ -34,6 +34,9 @@ from datetime import datetime, timedelta
 from subprocess import call, Popen, PIPE
 import sleepgraph as aslib
 import csv
+import json
+from bisect import bisect_left, bisect_right
+from multiprocessing import Pool, cpu_count
 
 # ----------------- CLASSES --------------------
 
@@ -50,6 +53,8 @@ class SystemValues(aslib.SystemValues):
 	dmesgfile = ''
 	ftracefile = ''
 	csvfile = 'devinit.csv'
+	csvexport = False
+	skiphtml = False
 	htmlfile = 'bootgraph.html'
 	testdir = ''
 	kparams = ''
@@ -62,6 +67,7 @@ class SystemValues(aslib.SystemValues):
 	reboot = False
 	manual = False
 	iscronjob = False
+	horizon = 120.0
 	timeformat = '%.6f'
 	bootloader = 'grub'
 	blexec = []
@@ -122,15 +128,9 @@ class SystemValues(aslib.SystemValues):
 		self.graph_filter = fs
 	def getBootFtraceFilterFunctions(self):
 		self.rootCheck(True)
-		fp = open(self.tpath+'available_filter_functions')
-		fulllist = fp.read().split('\n')
-		fp.close()
-		list = []
-		for i in fulllist:
-			if not i or ' ' in i or '[' in i or ']' in i:
-				continue
-			list.append(i)
-		return list
+		# built-in functions only, loadable module functions can't be
+		# traced at boot
+		return set([f for f in self.availableFunctions() if f not in self.ffuncmods])
 	def myCronJob(self, line):
 		if '@reboot' not in line:
 			return False
@@ -209,19 +209,21 @@ class Data(aslib.Data):
 	dmesg = {}  # root data structure
 	start = 0.0 # test start
 	end = 0.0   # test end
-	dmesgtext = []   # dmesg text file in memory
 	testnumber = 0
 	idstr = ''
 	html_device_id = 0
 	valid = False
 	tUserMode = 0.0
 	boottime = ''
+	stamped = False
 	phases = ['kernel', 'user']
 	do_one_initcall = False
+	pidindex = None
+	logsize = -1
 	def __init__(self, num):
 		self.testnumber = num
+		self.pidindex = None
 		self.idstr = 'a'
-		self.dmesgtext = []
 		self.dmesg = {
 			'kernel': {'list': dict(), 'start': -1.0, 'end': -1.0, 'row': 0,
 				'order': 0, 'color': 'linear-gradient(to bottom, #fff, #bcf)'},
@@ -246,27 +248,55 @@ class Data(aslib.Data):
 		list[name] = {'name': name, 'start': start, 'end': end,
 			'pid': pid, 'length': length, 'row': 0, 'id': devid,
 			'ret': ret, 'ulen': ulen }
+		self.pidindex = None
 		return name
-	def deviceMatch(self, pid, cg):
-		if cg.end - cg.start == 0:
-			return ''
-		for p in data.phases:
+	def indexInitcalls(self):
+		# per pid: the initcalls sorted by start, their start times, and
+		# the running max of their end times for containment lookups
+		self.pidindex = dict()
+		for p in self.phases:
 			list = self.dmesg[p]['list']
 			for devname in list:
 				dev = list[devname]
-				if pid != dev['pid']:
-					continue
-				if cg.name == 'do_one_initcall':
-					if(cg.start <= dev['start'] and cg.end >= dev['end'] and dev['length'] > 0):
-						dev['ftrace'] = cg
-						self.do_one_initcall = True
-						return devname
-				else:
-					if(cg.start > dev['start'] and cg.end < dev['end']):
-						if 'ftraces' not in dev:
-							dev['ftraces'] = []
-						dev['ftraces'].append(cg)
-						return devname
+				if dev['pid'] not in self.pidindex:
+					self.pidindex[dev['pid']] = []
+				self.pidindex[dev['pid']].append((dev['start'], devname, dev))
+		for pid in self.pidindex:
+			devs = sorted(self.pidindex[pid], key=lambda v:v[0])
+			starts, maxend, mx = [], [], -1.0
+			for start, devname, dev in devs:
+				mx = max(mx, dev['end'])
+				starts.append(start)
+				maxend.append(mx)
+			self.pidindex[pid] = (devs, starts, maxend)
+	def deviceMatch(self, pid, cg):
+		if cg.end - cg.start == 0:
+			return ''
+		if self.pidindex is None:
+			self.indexInitcalls()
+		if pid not in self.pidindex:
+			return ''
+		devs, starts, maxend = self.pidindex[pid]
+		if cg.name == 'do_one_initcall':
+			# an initcall that starts and ends inside the graph
+			for i in range(bisect_left(starts, cg.start), bisect_right(starts, cg.end)):
+				devname, dev = devs[i][1:]
+				if(cg.end >= dev['end'] and dev['length'] > 0):
+					dev['ftrace'] = cg
+					self.do_one_initcall = True
+					return devname
+		else:
+			# the latest starting initcall that encloses the graph, stop
+			# once no earlier initcall can end after the graph does
+			i = bisect_left(starts, cg.start) - 1
+			while i >= 0 and maxend[i] > cg.end:
+				devname, dev = devs[i][1:]
+				if(cg.end < dev['end']):
+					if 'ftraces' not in dev:
+						dev['ftraces'] = []
+					dev['ftraces'].append(cg)
+					return devname
+				i -= 1
 		return ''
 	def printDetails(self):
 		sysvals.vprint('Timeline Details:')
@@ -284,7 +314,10 @@ class Data(aslib.Data):
 
 # Function: parseKernelLog
 # Description:
-#	 parse a kernel log for boot data
+#	 parse a kernel log for boot data. The log is read as a stream up to
+#	 sysvals.horizon seconds of boot time (0 for all of it), and the byte
+#	 size of the part that was read is kept in data.logsize so -addlogs
+#	 can embed just that range of the file.
 def parseKernelLog():
 	sysvals.vprint('Analyzing the dmesg data (%s)...' % \
 		os.path.basename(sysvals.dmesgfile))
@@ -298,79 +331,93 @@ def parseKernelLog():
 
 	tp = aslib.TestProps()
 	devtemp = dict()
+	linefmt = re.compile('[ \t]*(\[ *)(?P<ktime>[0-9\.]*)(\]) (?P<msg>.*)')
+	callfmt = re.compile('^calling *(?P<f>.*)\+.* @ (?P<p>[0-9]*)')
+	retfmt = re.compile('^initcall *(?P<f>.*)\+.* returned (?P<r>.*) after (?P<t>.*) usecs')
+	clockfmt = re.compile('.* setting system clock to (?P<t>.*) UTC.*')
 	if(sysvals.dmesgfile):
 		lf = open(sysvals.dmesgfile, 'r')
 	else:
 		lf = Popen('dmesg', stdout=PIPE).stdout
-	csvfile = open(sysvals.csvfile, 'wb');
-	csvwriter = csv.writer(csvfile)
-	csvwriter.writerow(['Func', 'Start(ms)', 'End(ms)', 'Duration(ms)', 'Return'])
+	pos = last = 0
+	data.logsize = -1
 	for line in lf:
+		start, pos = pos, pos + len(line)
 		line = line.replace('\r\n', '')
 		# grab the stamp and sysinfo
-		if re.match(tp.stampfmt, line):
-			tp.stamp = line
-			continue
-		elif re.match(tp.sysinfofmt, line):
-			tp.sysinfo = line
-			continue
-		elif re.match(tp.cmdlinefmt, line):
-			tp.cmdline = line
-			continue
-		elif re.match(tp.kparamsfmt, line):
-			tp.kparams = line
-			continue
+		if line.startswith('#'):
+			if re.match(tp.stampfmt, line):
+				tp.stamp = line
+				continue
+			elif re.match(tp.sysinfofmt, line):
+				tp.sysinfo = line
+				continue
+			elif re.match(tp.cmdlinefmt, line):
+				tp.cmdline = line
+				continue
+			elif re.match(tp.kparamsfmt, line):
+				tp.kparams = line
+				continue
 		idx = line.find('[')
 		if idx > 1:
 			line = line[idx:]
-		m = re.match('[ \t]*(\[ *)(?P<ktime>[0-9\.]*)(\]) (?P<msg>.*)', line)
+		m = linefmt.match(line)
 		if(not m):
 			continue
 		ktime = float(m.group('ktime'))
-		if(ktime > 120):
+		if(sysvals.horizon > 0 and ktime > sysvals.horizon):
+			data.logsize = start
 			break
+		last = ktime
 		msg = m.group('msg')
-		data.dmesgtext.append(line)
-		if(ktime == 0.0 and re.match('^Linux version .*', msg)):
+		if(msg.startswith('calling')):
+			m = callfmt.match(msg)
+			if(m):
+				func = m.group('f')
+				pid = int(m.group('p'))
+				devtemp[func] = (ktime, pid)
+				continue
+		elif(msg.startswith('initcall')):
+			m = retfmt.match(msg)
+			if(m):
+				data.valid = True
+				sysvals.last_init = '%.0f'%(ktime*1000)
+				f, r, t = m.group('f', 'r', 't')
+				if(f in devtemp):
+					start, pid = devtemp[f]
+					data.newAction(phase, f, pid, start, ktime, int(r), int(t))
+					del devtemp[f]
+				continue
+		elif(ktime == 0.0 and msg.startswith('Linux version ')):
 			if(not sysvals.stamp['kernel']):
 				sysvals.stamp['kernel'] = sysvals.kernelVersion(msg)
 			continue
-		m = re.match('.* setting system clock to (?P<t>.*) UTC.*', msg)
-		if(m):
-			bt = datetime.strptime(m.group('t'), '%Y-%m-%d %H:%M:%S')
-			bt = bt - timedelta(seconds=int(ktime))
-			data.boottime = bt.strftime('%Y-%m-%d_%H:%M:%S')
-			sysvals.stamp['time'] = bt.strftime('%B %d %Y, %I:%M:%S %p')
-			continue
-		m = re.match('^calling *(?P<f>.*)\+.* @ (?P<p>[0-9]*)', msg)
-		if(m):
-			func = m.group('f')
-			pid = int(m.group('p'))
-			devtemp[func] = (ktime, pid)
-			continue
-		m = re.match('^initcall *(?P<f>.*)\+.* returned (?P<r>.*) after (?P<t>.*) usecs', msg)
-		if(m):
-			data.valid = True
-			sysvals.last_init = '%.0f'%(ktime*1000)
-			f, r, t = m.group('f', 'r', 't')
-			if(f in devtemp):
-				start, pid = devtemp[f]
-				data.newAction(phase, f, pid, start, ktime, int(r), int(t))
-				csvwriter.writerow([f, start*1000, ktime*1000, float(t)/1000, int(r)]);
-				del devtemp[f]
-			continue
-		if(re.match('^Freeing init kernel memory.*', msg)):
+		elif(msg.startswith('Freeing init kernel memory')):
 			data.tUserMode = ktime
 			data.dmesg['kernel']['end'] = ktime
 			data.dmesg['user']['start'] = ktime
 			data.end = ktime+0.1
 			phase = 'user'
+			continue
+		if('setting system clock to' in msg):
+			m = clockfmt.match(msg)
+			if(m):
+				bt = datetime.strptime(m.group('t'), '%Y-%m-%d %H:%M:%S')
+				bt = bt - timedelta(seconds=int(ktime))
+				data.boottime = bt.strftime('%Y-%m-%d_%H:%M:%S')
+				sysvals.stamp['time'] = bt.strftime('%B %d %Y, %I:%M:%S %p')
 
 	if tp.stamp:
 		sysvals.stamp = 0
 		tp.parseStamp(data, sysvals)
+	# the stamp time is only the boot time if it came from the log
+	data.stamped = bool(tp.stamp or data.boottime)
+	# init never started within the horizon, the timeline is all kernel
+	if phase == 'kernel' and data.valid:
+		sysvals.vprint('WARNING: no user mode start found in the dmesg data')
+		data.end = data.dmesg['kernel']['end'] = last
+		data.dmesg['user']['start'] = data.end
 	data.dmesg['user']['end'] = data.end
-	csvfile.close()
 	lf.close()
 	return data
 
@@ -380,7 +427,8 @@ def parseKernelLog():
 def parseTraceLog(data):
 	sysvals.vprint('Analyzing the ftrace data (%s)...' % \
 		os.path.basename(sysvals.ftracefile))
-	# if available, calculate cgfilter allowable ranges
+	# if available, calculate cgfilter allowable ranges, merged into
+	# sorted non-overlapping intervals for a bisect lookup
 	cgfilter = []
 	if len(sysvals.cgfilter) > 0:
 		for p in data.phases:
@@ -389,30 +437,41 @@ def parseTraceLog(data):
 				if i in list:
 					cgfilter.append([list[i]['start']-0.0001,
 						list[i]['end']+0.0001])
+		cgfilter.sort()
+		merged = []
+		for r in cgfilter:
+			if merged and r[0] <= merged[-1][1]:
+				merged[-1][1] = max(merged[-1][1], r[1])
+			else:
+				merged.append(r)
+		cgfilter = merged
+	cgstarts = [r[0] for r in cgfilter]
 	# parse the trace log
 	ftemp = dict()
 	tp = aslib.TestProps()
 	tp.setTracerType('function_graph')
+	lineregex = re.compile(tp.ftrace_line_fmt)
 	tf = open(sysvals.ftracefile, 'r')
 	for line in tf:
 		if line[0] == '#':
 			continue
-		m = re.match(tp.ftrace_line_fmt, line.strip())
+		# the timestamp is the first field, check it before the full parse
+		i = line.find('|')
+		try:
+			t = float(line[:i])
+		except:
+			continue
+		if t > data.end:
+			break
+		if len(cgfilter) > 0:
+			i = bisect_right(cgstarts, t) - 1
+			if i < 0 or t >= cgfilter[i][1]:
+				continue
+		m = lineregex.match(line.strip())
 		if(not m):
 			continue
 		m_time, m_proc, m_pid, m_msg, m_dur = \
 			m.group('time', 'proc', 'pid', 'msg', 'dur')
-		t = float(m_time)
-		if len(cgfilter) > 0:
-			allow = False
-			for r in cgfilter:
-				if t >= r[0] and t < r[1]:
-					allow = True
-					break
-			if not allow:
-				continue
-		if t > data.end:
-			break
 		if(m_time and m_pid and m_msg):
 			t = aslib.FTraceLine(m_time, m_msg, m_dur)
 			pid = int(m_pid)
@@ -508,9 +567,348 @@ def cgOverview(cg, minlen):
 			if l.name not in stats:
 				stats[l.name] = [0, 0.0]
 			stats[l.name][0] += (l.length * 1000.0)
-			stats[l.name][1] += 1
+			stats[l.name][1] += l.count
 	return (large, stats)
 
+# Function: writeCSV
+# Description:
+#	 Write rows to a csv file through a large buffer, in batches
+# Arguments:
+#	 file: the output csv file
+#	 header: the list of column names
+#	 rows: an iterable of row lists, consumed as it's written
+def writeCSV(file, header, rows, batch=1000):
+	fp = open(file, 'wb', 1024*1024)
+	cw = csv.writer(fp)
+	cw.writerow(header)
+	out = []
+	for row in rows:
+		out.append(row)
+		if len(out) >= batch:
+			cw.writerows(out)
+			out = []
+	cw.writerows(out)
+	fp.close()
+
+# Function: exportBootCSV
+# Description:
+#	 Export the initcalls to devinit.csv and, with -csv, export every
+#	 initcall with its callgraph overview to *_initcalls.csv, and the
+#	 nested calls of each callgraph (per initcall, caller, and function)
+#	 to *_callgraphs.csv. Needs only the parsed data, not the html.
+# Arguments:
+#	 data: the Data object from parseKernelLog/parseTraceLog
+def exportBootCSV(data):
+	initcalls = []
+	for p in data.phases:
+		list = data.dmesg[p]['list']
+		for devname in list:
+			initcalls.append((p, devname, list[devname]))
+	initcalls.sort(key=lambda v:(v[2]['end'], v[2]['start']))
+	writeCSV(sysvals.csvfile,
+		['Func', 'Start(ms)', 'End(ms)', 'Duration(ms)', 'Return'],
+		([n, d['start']*1000, d['end']*1000, d['ulen']/1000.0, d['ret']] \
+			for p, n, d in initcalls))
+	if not sysvals.csvexport:
+		return
+	base = sysvals.htmlfile
+	if base.endswith('.html'):
+		base = base[:-5]
+	def cglist(dev):
+		out = [dev['ftrace']] if 'ftrace' in dev else []
+		return out + (dev['ftraces'] if 'ftraces' in dev else [])
+	def initcallRows():
+		for p, n, d in sorted(initcalls, key=lambda v:v[2]['start']):
+			calls, top, toptime = 0, '', 0.0
+			for cg in cglist(d):
+				large, stats = cgOverview(cg, 0)
+				for f in stats:
+					calls += int(stats[f][1])
+					if stats[f][0] > toptime:
+						top, toptime = f, stats[f][0]
+			yield [n, p, d['pid'], '%.3f' % (d['start']*1000),
+				'%.3f' % (d['end']*1000), '%.3f' % ((d['end']-d['start'])*1000),
+				'%.3f' % (d['ulen']/1000.0), d['ret'], len(cglist(d)),
+				calls, top, '%.3f' % toptime]
+	def callgraphRows():
+		for p, n, d in sorted(initcalls, key=lambda v:v[2]['start']):
+			stats = dict()
+			for cg in cglist(d):
+				for stack, line, selftime in cg.walk():
+					key = (len(stack)-1, stack[-2] if len(stack) > 1 else '', line.name)
+					if key not in stats:
+						stats[key] = [0, 0.0, 0.0]
+					stats[key][0] += int(line.count)
+					stats[key][1] += line.length
+					stats[key][2] += selftime
+			for key in sorted(stats):
+				depth, parent, func = key
+				calls, total, selftime = stats[key]
+				yield [n, p, d['pid'], func, parent, depth, calls,
+					'%.3f' % (total*1000), '%.3f' % (selftime*1000)]
+	writeCSV(base+'_initcalls.csv', ['Initcall', 'Phase', 'Pid', 'Start(ms)',
+		'End(ms)', 'Duration(ms)', 'Reported(ms)', 'Return', 'Callgraphs',
+		'Calls', 'TopCall', 'TopCall(ms)'], initcallRows())
+	writeCSV(base+'_callgraphs.csv', ['Initcall', 'Phase', 'Pid', 'Function',
+		'Parent', 'Depth', 'Calls', 'Total(ms)', 'Self(ms)'], callgraphRows())
+	sysvals.vprint('CSV export: %s_initcalls.csv, %s_callgraphs.csv' % (base, base))
+
+# Function: bootSummaryFolder
+# Description:
+#	 Extract the initcall times of one boot for runBootSummary. Runs in a
+#	 pool process so the sysvals changes made by parseKernelLog stay there.
+# Arguments:
+#	 args: (dirname, dmesgfile)
+# Output:
+#	 dict of the boot host, kernel, time, user mode start, and
+#	 {initcall: ms}, an empty dict if the dmesg has no initcall data,
+#	 or None if it failed and should be retried on the next run
+def bootSummaryFolder(args):
+	dirname, file = args
+	try:
+		sysvals.dmesgfile = file
+		data = parseKernelLog()
+		if not data.valid:
+			return dict()
+		# without a stamp or clock line the log's mtime is the best guess
+		dt = datetime.fromtimestamp(os.path.getmtime(file))
+		if data.stamped:
+			try:
+				dt = datetime.strptime(sysvals.stamp['time'], '%B %d %Y, %I:%M:%S %p')
+			except:
+				pass
+		initcalls = dict()
+		for p in data.phases:
+			list = data.dmesg[p]['list']
+			for name in list:
+				initcalls[name] = list[name]['ulen'] / 1000.0
+		return {'dir': dirname, 'host': sysvals.stamp['host'],
+			'kernel': sysvals.stamp['kernel'] or 'unknown',
+			'time': dt.strftime('%Y-%m-%d %H:%M:%S'),
+			'boot': (data.tUserMode - data.start) * 1000,
+			'initcalls': initcalls}
+	except:
+		print('WARNING: failed to summarize %s, skipping it' % file)
+		return None
+
+# Function: bootSummaryStats
+# Description:
+#	 Group the boots by host and kernel, with the kernels of each host in
+#	 the order they were last booted, and get the boot time and initcall
+#	 time distributions of each group
+# Arguments:
+#	 boots: the bootSummaryFolder dicts
+# Output:
+#	 {host: [(kernel, boots, boot SummaryStat, {initcall: SummaryStat})]}
+def bootSummaryStats(boots):
+	groups = dict()
+	for b in sorted(boots, key=lambda v:v['time']):
+		key = (b['host'], b['kernel'])
+		if key not in groups:
+			groups[key] = (aslib.SummaryStat(), dict())
+		bstat, istat = groups[key]
+		bstat.add(b['boot'], b)
+		for name in b['initcalls']:
+			if name not in istat:
+				istat[name] = aslib.SummaryStat()
+			istat[name].add(b['initcalls'][name], b)
+	out = dict()
+	for host, kernel in groups:
+		bstat, istat = groups[(host, kernel)]
+		if host not in out:
+			out[host] = []
+		out[host].append((kernel, bstat.rows, bstat, istat))
+	for host in out:
+		out[host].sort(key=lambda v:v[1][-1]['time'])
+	return out
+
+# Function: bootSummaryReport
+# Description:
+#	 Write the boot comparison report to stdout and an html file: per host
+#	 a table of kernels with their boot time spread, the slowest initcalls
+#	 of the last kernel across its boots, and the initcalls whose median
+#	 or p90 time moved the most between each kernel and the one before it
+# Arguments:
+#	 stats: the output of bootSummaryStats
+#	 htmlfile: the html report file
+#	 folder: the folder the boots were read from
+#	 count: the number of initcalls to report per table
+def bootSummaryReport(stats, htmlfile, folder, count=20):
+	report = []
+	for host in sorted(stats):
+		kernels = stats[host]
+		kernel, rows, bstat, istat = kernels[-1]
+		slow = sorted(istat.items(), key=lambda v:v[1].median()[0],
+			reverse=True)[:count]
+		changes = []
+		for i in range(1, len(kernels)):
+			a, b = kernels[i-1][3], kernels[i][3]
+			movers = []
+			for name in b:
+				if name not in a:
+					continue
+				p50 = (a[name].median()[0], b[name].median()[0])
+				p90 = (a[name].percentile(90)[0], b[name].percentile(90)[0])
+				move = max(abs(p50[1] - p50[0]), abs(p90[1] - p90[0]))
+				movers.append((move, name, a[name].num, b[name].num, p50, p90))
+			movers.sort(key=lambda v:v[0], reverse=True)
+			changes.append((kernels[i-1][0], kernels[i][0], movers[:count]))
+		report.append((host, kernels, slow, changes))
+
+	# text report
+	kfmt = '%-32s %6s %10s %10s %10s %10s  %s'
+	sfmt = '%-40s %6s %9s %9s %9s %9s'
+	cfmt = '%-40s %9s %9s %9s %9s %9s %9s'
+	for host, kernels, slow, changes in report:
+		print('%s: %d kernels' % (host, len(kernels)))
+		print(kfmt % ('Kernel', 'Boots', 'Min', 'Median', 'P90', 'Max', 'Last boot'))
+		for kernel, rows, bstat, istat in kernels:
+			print(kfmt % (kernel[:32], bstat.num, '%.3f' % bstat.min,
+				'%.3f' % bstat.median()[0], '%.3f' % bstat.percentile(90)[0],
+				'%.3f' % bstat.max, rows[-1]['time']))
+		print('\nSlowest initcalls on %s (ms)' % kernels[-1][0])
+		print(sfmt % ('Initcall', 'Boots', 'Min', 'Median', 'P90', 'Max'))
+		for name, st in slow:
+			print(sfmt % (name[:40], st.num, '%.3f' % st.min,
+				'%.3f' % st.median()[0], '%.3f' % st.percentile(90)[0],
+				'%.3f' % st.max))
+		for old, new, movers in changes:
+			print('\n%s -> %s (ms)' % (old, new))
+			print(cfmt % ('Initcall', 'P50', 'P50', 'dP50', 'P90', 'P90', 'dP90'))
+			for move, name, na, nb, p50, p90 in movers:
+				print(cfmt % (name[:40], '%.3f' % p50[0], '%.3f' % p50[1],
+					'%+.3f' % (p50[1] - p50[0]), '%.3f' % p90[0],
+					'%.3f' % p90[1], '%+.3f' % (p90[1] - p90[0])))
+		print('')
+
+	# html report
+	hf = open(htmlfile, 'w')
+	hf.write('<!DOCTYPE html>\n<html>\n<head>\n\
+	<meta http-equiv="content-type" content="text/html; charset=UTF-8">\n\
+	<title>BootGraph Summary</title>\n\
+	<style type=\'text/css\'>\n\
+		.stamp {width: 100%;text-align:center;background:#888;line-height:30px;color:white;font: 25px Arial;}\n\
+		table {width:100%;border-collapse: collapse;margin-bottom:20px;}\n\
+		.summary {border:1px solid;}\n\
+		th {border: 1px solid black;background:#222;color:white;}\n\
+		td {font: 14px "Times New Roman";text-align: center;}\n\
+		tr.head td {border: 1px solid black;background:#aaa;}\n\
+		tr.alt {background-color:#ddd;}\n\
+		.slower {color:red;}\n\
+		.faster {color:green;}\n\
+	</style>\n</head>\n<body>\n')
+	hf.write('<div class="stamp">%s</div>\n' % folder)
+	th = '\t<th>{0}</th>\n'
+	td = '\t<td>{0}</td>\n'
+	tdd = '\t<td class={1}>{0}</td>\n'
+	def table(title, cols, rows):
+		hf.write('<table class="summary">\n<tr class="head"><td colspan=%d>' % \
+			len(cols) + title + '</td></tr>\n<tr>\n')
+		for h in cols:
+			hf.write(th.format(h))
+		hf.write('</tr>\n')
+		for num, html in enumerate(rows):
+			hf.write(('<tr class="alt">\n' if num % 2 == 1 else '<tr>\n')+\
+				html+'</tr>\n')
+		hf.write('</table>\n')
+	for host, kernels, slow, changes in report:
+		rows = []
+		for kernel, brows, bstat, istat in kernels:
+			html = td.format(kernel) + td.format(bstat.num)
+			for v in [bstat.min, bstat.median()[0], bstat.percentile(90)[0],
+				bstat.max]:
+				html += td.format('%.3f ms' % v)
+			rows.append(html + td.format(brows[-1]['time']))
+		table('%s: boot time (kernel start to user mode)' % host, ['Kernel',
+			'Boots', 'Min', 'Median', 'P90', 'Max', 'Last boot'], rows)
+		rows = []
+		for name, st in slow:
+			html = td.format(name) + td.format(st.num)
+			for v in [st.min, st.median()[0], st.percentile(90)[0], st.max]:
+				html += td.format('%.3f ms' % v)
+			rows.append(html)
+		table('%s: slowest initcalls on %s' % (host, kernels[-1][0]),
+			['Initcall', 'Boots', 'Min', 'Median', 'P90', 'Max'], rows)
+		for old, new, movers in changes:
+			rows = []
+			for move, name, na, nb, p50, p90 in movers:
+				html = td.format(name) + td.format('%d / %d' % (na, nb))
+				for v in [p50, p90]:
+					d = v[1] - v[0]
+					html += td.format('%.3f ms' % v[0]) + td.format('%.3f ms' % v[1])
+					html += tdd.format('%+.3f ms' % d, 'slower' if d > 0 else 'faster')
+				rows.append(html)
+			table('%s: %s &rarr; %s' % (host, old, new), ['Initcall', 'Boots',
+				'P50 old', 'P50 new', 'P50 change', 'P90 old', 'P90 new',
+				'P90 change'], rows)
+	hf.write('</body>\n</html>\n')
+	hf.close()
+
+# Function: runBootSummary
+# Description:
+#	 Compare all the boots in a folder tree, e.g. a series of -reboot
+#	 runs. Every folder with a dmesg log is a boot, they're parsed by a
+#	 pool of sysvals.jobs processes (default: one per cpu). The per boot
+#	 results are kept in bootsummary.jsonl in the current folder, so a
+#	 rerun only parses the boots that are new or have changed since.
+# Arguments:
+#	 subdir: the folder to search for boots
+def runBootSummary(subdir):
+	inpath = os.path.abspath(subdir)
+	print('Generating a boot summary of folder "%s"' % inpath)
+	indexfile = os.path.abspath('bootsummary.jsonl')
+	index, lines = aslib.summaryIndex(indexfile)
+	dirs, tasks, mtimes = [], [], dict()
+	for dirname, dirnames, filenames in os.walk(inpath):
+		dirnames.sort()
+		files = sorted([f for f in filenames if re.match('.*_dmesg.txt$', f)])
+		if not files:
+			continue
+		file = os.path.join(dirname, files[0])
+		dirs.append(dirname)
+		mtimes[dirname] = os.path.getmtime(file)
+		if dirname in index and index[dirname]['mtime'] == mtimes[dirname]:
+			continue
+		tasks.append((dirname, file))
+	sysvals.vprint('%d boots, %d new or changed' % (len(dirs), len(tasks)))
+	jobs = sysvals.jobs if sysvals.jobs > 0 else cpu_count()
+	jobs = min(jobs, len(tasks))
+	if jobs > 1:
+		pool = Pool(jobs)
+		results = pool.map(bootSummaryFolder, tasks, 1)
+		pool.close()
+		pool.join()
+	else:
+		results = map(bootSummaryFolder, tasks)
+	# drop boots under inpath which are gone, add the new results
+	for dirname in index.keys():
+		if (dirname == inpath or dirname.startswith(inpath+os.sep)) and \
+			dirname not in dirs:
+			del index[dirname]
+	new = []
+	for i in range(len(tasks)):
+		# a failed boot isn't indexed, so the next run retries it
+		if results[i] is None:
+			continue
+		dirname = tasks[i][0]
+		entry = {'dir': dirname, 'mtime': mtimes[dirname], 'boot': results[i]}
+		index[dirname] = entry
+		new.append(entry)
+	# append to the index, or rewrite it once it's mostly stale lines
+	if lines + len(new) > 2 * len(index):
+		fp, new = open(indexfile, 'w'), [index[d] for d in sorted(index)]
+	else:
+		fp = open(indexfile, 'a')
+	for entry in new:
+		fp.write(json.dumps(entry, sort_keys=True)+'\n')
+	fp.close()
+	boots = [index[d]['boot'] for d in dirs if d in index and index[d]['boot']]
+	if len(boots) < 1:
+		doError('no boots with initcall data found in %s' % inpath)
+	outfile = os.path.abspath('bootsummary.html')
+	bootSummaryReport(bootSummaryStats(boots), outfile, inpath)
+	print('Summary file: %s' % outfile)
+
 # Function: createBootGraph
 # Description:
 #	 Create the output html file from the resident test data
@@ -688,12 +1086,8 @@ def createBootGraph(data):
 	if sysvals.testlog and sysvals.logmsg:
 		hf.write('<div id="testlog" style="display:none;">\n'+sysvals.logmsg+'</div>\n')
 	# add the dmesg log as a hidden div
-	if sysvals.dmesglog:
-		hf.write('<div id="dmesglog" style="display:none;">\n')
-		for line in data.dmesgtext:
-			line = line.replace('<', '&lt').replace('>', '&gt')
-			hf.write(line)
-		hf.write('</div>\n')
+	if sysvals.dmesglog and sysvals.dmesgfile:
+		aslib.addLogHTML(sysvals, hf, 'dmesglog', sysvals.dmesgfile, data.logsize)
 
 	# write the footer and close
 	aslib.addScriptCode(hf, [data])
@@ -860,16 +1254,21 @@ def printHelp():
 	print('  -v            Print the current tool version')
 	print('  -verbose      Print extra information during execution and analysis')
 	print('  -addlogs      Add the dmesg log to the html output')
+	print('  -ziplogs      Store the -addlogs log in the html as a compressed blob')
 	print('  -result fn    Export a results table to a text file for parsing.')
+	print('  -csv          Export the initcalls and callgraph call stats to csv files')
+	print('  -skiphtml     Skip the html timeline, e.g. when only the csv files are wanted')
 	print('  -o name       Overrides the output subdirectory name when running a new test')
 	print('                default: boot-{date}-{time}')
 	print(' [advanced]')
 	print('  -fstat        Use ftrace to add function detail and statistics (default: disabled)')
 	print('  -f/-callgraph Add callgraph detail, can be very large (default: disabled)')
 	print('  -maxdepth N   limit the callgraph data to N call levels (default: 2)')
+	print('  -horizon S    Only read the dmesg up to S seconds of boot time, 0 for all (default: 120)')
 	print('  -mincg ms     Discard all callgraphs shorter than ms milliseconds (e.g. 0.001 for us)')
 	print('  -timeprec N   Number of significant digits in timestamps (0:S, 3:ms, [6:us])')
 	print('  -expandcg     pre-expand the callgraph data in the html output (default: disabled)')
+	print('  -flamegraph   export the ftrace data as folded stacks and per function self time')
 	print('  -func list    Limit ftrace to comma-delimited list of functions (default: do_one_initcall)')
 	print('  -cgfilter S   Filter the callgraph output in the timeline')
 	print('  -cgskip file  Callgraph functions to skip, off to disable (default: cgskip.txt)')
@@ -880,6 +1279,8 @@ def printHelp():
 	print('Other commands:')
 	print('  -flistall     Print all functions capable of being captured in ftrace')
 	print('  -sysinfo      Print out system info extracted from BIOS')
+	print('  -summary dir  Compare the initcall times of all the boots in dir')
+	print('                across boots and kernels (-jobs N, default: cpu count)')
 	print(' [redo]')
 	print('  -dmesg file   Create HTML output using dmesg input (used with -ftrace)')
 	print('  -ftrace file  Create HTML output using ftrace input (used with -dmesg)')
@@ -946,6 +1347,8 @@ if __name__ == '__main__':
 			sysvals.bootloader = val.lower()
 		elif(arg == '-timeprec'):
 			sysvals.setPrecision(aslib.getArgInt('-timeprec', args, 0, 6))
+		elif(arg == '-horizon'):
+			sysvals.horizon = aslib.getArgFloat('-horizon', args, 0.0, 1000000.0)
 		elif(arg == '-maxdepth'):
 			mdset = True
 			sysvals.max_graph_depth = aslib.getArgInt('-maxdepth', args, 0, 1000)
@@ -969,8 +1372,16 @@ if __name__ == '__main__':
 			sysvals.ftracefile = val
 		elif(arg == '-addlogs'):
 			sysvals.dmesglog = True
+		elif(arg == '-ziplogs'):
+			sysvals.ziplogs = True
 		elif(arg == '-expandcg'):
 			sysvals.cgexp = True
+		elif(arg == '-csv'):
+			sysvals.csvexport = True
+		elif(arg == '-skiphtml'):
+			sysvals.skiphtml = True
+		elif(arg == '-flamegraph'):
+			sysvals.flamegraph = True
 		elif(arg == '-dmesg'):
 			try:
 				val = args.next()
@@ -980,6 +1391,17 @@ if __name__ == '__main__':
 				doError('%s does not exist' % val)
 			testrun = False
 			sysvals.dmesgfile = val
+		elif(arg == '-summary'):
+			try:
+				val = args.next()
+			except:
+				doError('No directory supplied', True)
+			if(os.path.isdir(val) == False):
+				doError('%s is not accesible' % val)
+			cmd = 'summary'
+			summarydir = val
+		elif(arg == '-jobs'):
+			sysvals.jobs = aslib.getArgInt('-jobs', args, 1, 1024)
 		elif(arg == '-o'):
 			try:
 				val = args.next()
@@ -1009,6 +1431,9 @@ if __name__ == '__main__':
 		doError('-cronjob is meant for batch purposes only')
 	if(sysvals.reboot and (sysvals.dmesgfile or sysvals.ftracefile)):
 		doError('-reboot and -dmesg/-ftrace are incompatible')
+	if cmd == 'summary':
+		runBootSummary(summarydir)
+		sys.exit()
 	if cmd or sysvals.reboot or sysvals.iscronjob or testrun:
 		sysvals.rootCheck(True)
 	if (testrun and sysvals.useftrace) or cmd == 'flistall':
@@ -1021,7 +1446,7 @@ if __name__ == '__main__':
 		if cmd == 'kpupdate':
 			updateKernelParams()
 		elif cmd == 'flistall':
-			for f in sysvals.getBootFtraceFilterFunctions():
+			for f in sorted(sysvals.getBootFtraceFilterFunctions()):
 				print f
 		elif cmd == 'checkbl':
 			sysvals.getBootLoader()
@@ -1074,14 +1499,20 @@ if __name__ == '__main__':
 		if sysvals.cgdump:
 			data.debugPrint()
 			sys.exit()
+		if sysvals.useftrace and sysvals.ftracefile:
+			data.optimizeCallgraphs()
 	else:
 		doError('dmesg file required')
 
-	sysvals.vprint('Creating the html timeline (%s)...' % sysvals.htmlfile)
-	sysvals.vprint('Command:\n    %s' % sysvals.cmdline)
-	sysvals.vprint('Kernel parameters:\n    %s' % sysvals.kparams)
+	exportBootCSV(data)
 	data.printDetails()
-	createBootGraph(data)
+	if not sysvals.skiphtml:
+		sysvals.vprint('Creating the html timeline (%s)...' % sysvals.htmlfile)
+		sysvals.vprint('Command:\n    %s' % sysvals.cmdline)
+		sysvals.vprint('Kernel parameters:\n    %s' % sysvals.kparams)
+		createBootGraph(data)
+	if sysvals.useftrace and sysvals.flamegraph:
+		aslib.createFlameGraphFiles(sysvals, [data])
 
 	# if running as root, change output dir owner to sudo_user
 	if testrun and os.path.isdir(sysvals.testdir) and \
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+#
+# Generate a synthetic boot dmesg and function_graph ftrace log
+#
+# Usage: bootgen.py count outdir
+#
+# Writes outdir/synth_boot_dmesg.txt and outdir/synth_boot_ftrace.txt with
+# count initcalls, mostly on pid 1 with some async ones on pids 2-4. Most
+# initcalls get a do_one_initcall graph, every 7th one only gets a graph
+# of a function nested inside it (so it's matched as an enclosed graph),
+# and every 11th gap between initcalls gets an orphan graph which should
+# match nothing. The output is the same for every run.
+#
+
+import sys
+import os
+import random
+
+def ftraceLine(time, pid, dur, msg):
+	d = ('%.3f us' % dur) if dur is not None else ''
+	return '%12.6f |   0)  swapper/0-%-5d |  %10s   |  %s\n' % (time, pid, d, msg)
+
+def leaves(ft, pid, start, length, depth):
+	for j in range(3):
+		t = start + length * (j + 1) / 5
+		ft.write(ftraceLine(t, pid, 1.5, '%sleaf_%d();' % ('  ' * depth, j % 2)))
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		print('Usage: bootgen.py count outdir')
+		sys.exit(1)
+	random.seed(1)
+	count, out = int(sys.argv[1]), sys.argv[2]
+	if not os.path.isdir(out):
+		os.makedirs(out)
+	dm = open(os.path.join(out, 'synth_boot_dmesg.txt'), 'w')
+	ft = open(os.path.join(out, 'synth_boot_ftrace.txt'), 'w')
+	hdr = '# boot-101926-120000 synth boot 4.15.0-synth\n'+\
+		'# sysinfo | man:x | plat:y | cpu:z | bios:b | numcpu:4 | memsz:1 | memfr:1\n'+\
+		'# command | bootgraph\n# kparams | quiet\n'
+	dm.write(hdr)
+	ft.write(hdr + '# tracer: function_graph\n#\n')
+	dm.write('[    0.000000] Linux version 4.15.0-synth (x@y) #1 SMP\n')
+	t = 0.5
+	for i in range(count):
+		pid = 1 if i % 5 else 2 + (i % 3)
+		start = t
+		length = random.uniform(0.00002, 0.0005)
+		end = start + length
+		f = 'init_%d' % i
+		dm.write('[%12.6f] calling  %s+0x0/0x10 @ %d\n' % (start, f, pid))
+		if i % 7:
+			ft.write(ftraceLine(start - 0.000001, pid, None, 'do_one_initcall() {'))
+			ft.write(ftraceLine(start, pid, None, '  %s() {' % f))
+			leaves(ft, pid, start, length, 2)
+			ft.write(ftraceLine(end, pid, length * 1e6, '  } /* %s */' % f))
+			ft.write(ftraceLine(end + 0.000001, pid, length * 1e6 + 2,
+				'} /* do_one_initcall */'))
+		else:
+			ps, pl = start + length / 4, length / 2
+			ft.write(ftraceLine(ps, pid, None, 'probe_%d() {' % i))
+			leaves(ft, pid, ps, pl, 1)
+			ft.write(ftraceLine(ps + pl, pid, pl * 1e6, '} /* probe_%d */' % i))
+		dm.write('[%12.6f] initcall %s+0x0/0x10 returned 0 after %d usecs\n' % \
+			(end, f, int(length * 1e6)))
+		t = end + 0.00001
+		if i % 11 == 0:
+			ft.write(ftraceLine(t, pid, None, 'orphan_%d() {' % i))
+			leaves(ft, pid, t, 0.000004, 1)
+			ft.write(ftraceLine(t + 0.000004, pid, 4.0, '} /* orphan_%d */' % i))
+			t += 0.00001
+	dm.write('[%12.6f] Freeing init kernel memory: 1000K\n' % (t + 0.01))
+	dm.close()
+	ft.close()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+#
+# Check bootgraph's indexed callgraph matching against a linear scan
+#
+# Usage: matchtest.py dmesgfile ftracefile
+#
+# Parses the logs with bootgraph and, for every callgraph it tries to
+# match, compares the initcall picked by Data.deviceMatch with the one the
+# original linear scan over all the initcalls picks. Then does the same
+# for a fixed set of random intervals around the initcalls. Prints the
+# counts and exits with status 1 on any difference.
+#
+
+import sys
+import os
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+args = sys.argv[1:]
+sys.argv = sys.argv[:1]
+import bootgraph
+
+# the pre-index deviceMatch, without the side effects, scanning the
+# initcalls of each phase in start order
+def linearMatch(data, pid, cg):
+	if cg.end - cg.start == 0:
+		return ''
+	if not hasattr(data, 'linear'):
+		data.linear = []
+		for p in data.phases:
+			list = data.dmesg[p]['list']
+			for devname in sorted(list, key=lambda k:list[k]['start']):
+				data.linear.append((devname, list[devname]))
+	for devname, dev in data.linear:
+		if pid != dev['pid']:
+			continue
+		if cg.name == 'do_one_initcall':
+			if(cg.start <= dev['start'] and cg.end >= dev['end'] and dev['length'] > 0):
+				return devname
+		else:
+			if(cg.start > dev['start'] and cg.end < dev['end']):
+				return devname
+	return ''
+
+class Interval:
+	def __init__(self, name, start, end):
+		self.name, self.start, self.end = name, start, end
+
+if __name__ == '__main__':
+	if len(args) != 2:
+		print('Usage: matchtest.py dmesgfile ftracefile')
+		sys.exit(1)
+	sv = bootgraph.sysvals
+	sv.dmesgfile, sv.ftracefile = args
+	sv.useftrace = sv.usecallgraph = True
+	bootgraph.data = data = bootgraph.parseKernelLog()
+	# check every match made while parsing the trace
+	stats = {'graphs': 0, 'matched': 0, 'diffs': 0}
+	indexMatch = bootgraph.Data.deviceMatch
+	def checkMatch(self, pid, cg):
+		ref = linearMatch(self, pid, cg)
+		out = indexMatch(self, pid, cg)
+		stats['graphs'] += 1
+		if out:
+			stats['matched'] += 1
+		if out != ref:
+			stats['diffs'] += 1
+			print('DIFF: %s pid %d [%f - %f]: %s != %s' % \
+				(cg.name, pid, cg.start, cg.end, out, ref))
+		return out
+	bootgraph.Data.deviceMatch = checkMatch
+	bootgraph.parseTraceLog(data)
+	bootgraph.Data.deviceMatch = indexMatch
+	print('%d callgraphs, %d matched, %d differences' % \
+		(stats['graphs'], stats['matched'], stats['diffs']))
+	# random intervals near the initcalls, on their pids and others
+	random.seed(2)
+	devs = [v for p in data.phases for v in data.dmesg[p]['list'].values()]
+	rdiffs = 0
+	for i in range(20000):
+		dev = random.choice(devs)
+		start = dev['start'] + random.uniform(-0.00005, dev['end'] - dev['start'])
+		cg = Interval('do_one_initcall' if i % 3 == 0 else 'x',
+			start, start + random.uniform(0, 0.0006))
+		pid = dev['pid'] if i % 7 else 99
+		ref = linearMatch(data, pid, cg)
+		if indexMatch(data, pid, cg) != ref:
+			rdiffs += 1
+	print('20000 random intervals, %d differences' % rdiffs)
+	if stats['diffs'] or rdiffs:
+		print('FAIL')
+		sys.exit(1)
+	print('PASS')
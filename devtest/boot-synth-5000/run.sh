@@ -0,0 +1,6 @@
+# params = boot: 5000 synthetic initcalls, indexed vs linear callgraph match
+# output file = matchtest.txt
+#!/bin/sh
+
+./bootgen.py 5000 . || exit 1
+./matchtest.py synth_boot_dmesg.txt synth_boot_ftrace.txt > matchtest.txt
@@ -58,7 +58,16 @@ from datetime import datetime
 import struct
 import ConfigParser
 import gzip
+import zlib
+import base64
+import csv
+import json
+import sqlite3
+import signal
+import resource
+from cStringIO import StringIO
 from threading import Thread
+from multiprocessing import Pool, Process, cpu_count
 from subprocess import call, Popen, PIPE
 
 # ----------------- CLASSES --------------------
@@ -79,21 +88,32 @@ class SystemValues:
 	testlog = True
 	dmesglog = False
 	ftracelog = False
+	ziplogs = False
 	mindevlen = 0.0
 	mincglen = 0.0
 	cgphase = ''
 	cgtest = -1
 	cgskip = ''
-	multitest = {'run': False, 'count': 0, 'delay': 0}
+	multitest = {'run': False, 'count': 0, 'delay': 0, 'batch': ''}
 	max_graph_depth = 0
 	callloopmaxgap = 0.0001
 	callloopmaxlen = 0.005
 	bufsize = 0
 	cpucount = 0
+	jobs = 0
+	devdb = ''
+	daemonbatch = 10
+	cachedir = os.path.expanduser('~/.cache/pm-graph')
+	ffuncs = None
+	ffuncmods = dict()
+	daemonmaxlines = 500000
 	memtotal = 204800
 	memfree = 204800
 	srgap = 0
 	cgexp = False
+	cglazy = False
+	flamegraph = False
+	cgstats = 0
 	testdir = ''
 	outdir = ''
 	tpath = '/sys/kernel/debug/tracing/'
@@ -438,7 +458,7 @@ class SystemValues:
 		if not current:
 			call('cat '+self.tpath+'available_filter_functions', shell=True)
 			return
-		master = self.listFromFile(self.tpath+'available_filter_functions')
+		master = self.availableFunctions()
 		for i in self.tracefuncs:
 			if 'func' in self.tracefuncs[i]:
 				i = self.tracefuncs[i]['func']
@@ -447,15 +467,15 @@ class SystemValues:
 			else:
 				print self.colorText(i)
 	def setFtraceFilterFunctions(self, list):
-		master = self.listFromFile(self.tpath+'available_filter_functions')
+		master = self.availableFunctions()
 		flist = ''
 		for i in list:
-			if i not in master:
+			# "func" or "func [module]"
+			f = i.split(' ')
+			if f[0] not in master or (len(f) > 1 and \
+				self.ffuncmods.get(f[0], '') != f[1].strip('[]')):
 				continue
-			if ' [' in i:
-				flist += i.split(' ')[0]+'\n'
-			else:
-				flist += i+'\n'
+			flist += f[0]+'\n'
 		fp = open(self.tpath+'set_graph_function', 'w')
 		fp.write(flist)
 		fp.close()
@@ -527,19 +547,99 @@ class SystemValues:
 			val += ' %s=%s' % (i, args[i])
 		val += '\nr:%s_ret %s $retval\n' % (name, func)
 		return val
+	def cacheFile(self, name):
+		# per kernel build cache file, keyed on the full /proc/version
+		v = self.getVal('/proc/version')
+		return os.path.join(self.cachedir,
+			'%s-%08x.json' % (name, zlib.crc32(v) & 0xffffffff))
+	def loadCache(self, name):
+		try:
+			fp = open(self.cacheFile(name), 'r')
+			out = json.load(fp)
+			fp.close()
+		except:
+			return dict()
+		return out
+	def saveCache(self, name, data):
+		# under sudo, hand everything created back to the invoking user
+		top = self.cachedir
+		while not os.path.exists(os.path.dirname(top)):
+			top = os.path.dirname(top)
+		try:
+			if not os.path.isdir(self.cachedir):
+				os.makedirs(self.cachedir)
+			fp = open(self.cacheFile(name), 'w')
+			json.dump(data, fp)
+			fp.close()
+		except:
+			pass
+		self.sudouser(top)
+	def availableFunctions(self):
+		# the traceable functions as a set, plus a map of the ones that
+		# belong to modules. available_filter_functions is slow to read
+		# so it's cached on disk per kernel build and set of loaded modules
+		if self.ffuncs is not None:
+			return self.ffuncs
+		self.ffuncs, self.ffuncmods = set(), dict()
+		file = self.tpath+'available_filter_functions'
+		if not os.path.exists(file):
+			return self.ffuncs
+		mods = [l.split(' ')[0] for l in self.getVal('/proc/modules').split('\n')]
+		mkey = '%08x' % (zlib.crc32(' '.join(sorted(mods))) & 0xffffffff)
+		cache = self.loadCache('ffuncs')
+		if 'modules' in cache and cache['modules'] == mkey:
+			self.ffuncs, self.ffuncmods = set(cache['funcs']), cache['mods']
+			return self.ffuncs
+		try:
+			fp = open(file)
+		except:
+			return self.ffuncs
+		for line in fp:
+			f = line.split()
+			if not f:
+				continue
+			self.ffuncs.add(f[0])
+			if len(f) > 1 and f[1][0] == '[':
+				self.ffuncmods[f[0]] = f[1].strip('[]')
+		fp.close()
+		self.saveCache('ffuncs', {'modules': mkey,
+			'funcs': list(self.ffuncs), 'mods': self.ffuncmods})
+		return self.ffuncs
 	def addKprobes(self, output=False):
 		if len(self.kprobes) < 1:
 			return
 		if output:
 			print('    kprobe functions in this kernel:')
-		# first test each kprobe
+		# first validate each kprobe: drop functions ftrace doesn't know
+		# about right now, reuse the test results cached for this kernel
+		# build, and test the rest in bulk, bisecting only when a write
+		# fails. Only the test results are cached, the available functions
+		# change as modules are loaded and are checked on every run
+		self.fsetVal('0', 'events/kprobes/enable')
+		cache = self.loadCache('kprobes')
+		avail = self.availableFunctions()
+		kptext, valid = dict(), dict()
+		test = []
+		for name in sorted(self.kprobes):
+			kptext[name] = self.kprobeText(name, self.kprobes[name])
+			func = self.kprobes[name]['func'] if 'func' in self.kprobes[name] else name
+			if len(avail) > 0 and func not in avail:
+				valid[name] = False
+			elif kptext[name] in cache:
+				valid[name] = cache[kptext[name]]
+			else:
+				test.append(name)
+		good = self.testKprobes(test)
+		for name in test:
+			valid[name] = cache[kptext[name]] = name in good
+		self.saveCache('kprobes', cache)
 		rejects = []
 		# sort kprobes: trace, ub-dev, custom, dev
 		kpl = [[], [], [], []]
 		linesout = len(self.kprobes)
 		for name in sorted(self.kprobes):
 			res = self.colorText('YES', 32)
-			if not self.testKprobe(name, self.kprobes[name]):
+			if not valid[name]:
 				res = self.colorText('NO')
 				rejects.append(name)
 			else:
@@ -562,28 +662,40 @@ class SystemValues:
 		self.fsetVal('', 'kprobe_events')
 		kprobeevents = ''
 		for kp in kplist:
-			kprobeevents += self.kprobeText(kp, self.kprobes[kp])
-		self.fsetVal(kprobeevents, 'kprobe_events')
+			kprobeevents += kptext[kp]
+		if not self.fsetVal(kprobeevents, 'kprobe_events') and len(test) < len(kplist):
+			# a stale cache, validate everything again
+			self.fsetVal('', 'kprobe_events')
+			good = self.testKprobes(kplist)
+			for name in kplist:
+				if name not in good:
+					self.kprobes.pop(name)
+			cache.update(dict((kptext[n], n in good) for n in kplist))
+			self.saveCache('kprobes', cache)
+			self.fsetVal('', 'kprobe_events')
+			self.fsetVal(''.join([kptext[n] for n in good]), 'kprobe_events')
 		if output:
 			check = self.fgetVal('kprobe_events')
 			linesack = (len(check.split('\n')) - 1) / 2
 			print('    kprobe functions enabled: %d/%d' % (linesack, linesout))
 		self.fsetVal('1', 'events/kprobes/enable')
-	def testKprobe(self, kname, kprobe):
-		self.fsetVal('0', 'events/kprobes/enable')
-		kprobeevents = self.kprobeText(kname, kprobe)
-		if not kprobeevents:
-			return False
-		try:
-			self.fsetVal(kprobeevents, 'kprobe_events')
+	def testKprobes(self, names):
+		# register the kprobes in one write, split the list in half and
+		# retry each part if the kernel rejects any of them
+		if len(names) < 1:
+			return []
+		kprobeevents = ''
+		for name in names:
+			kprobeevents += self.kprobeText(name, self.kprobes[name])
+		self.fsetVal('', 'kprobe_events')
+		if self.fsetVal(kprobeevents, 'kprobe_events'):
 			check = self.fgetVal('kprobe_events')
-		except:
-			return False
-		linesout = len(kprobeevents.split('\n'))
-		linesack = len(check.split('\n'))
-		if linesack < linesout:
-			return False
-		return True
+			if len(check.split('\n')) >= len(kprobeevents.split('\n')):
+				return names
+		if len(names) == 1:
+			return []
+		half = len(names) / 2
+		return self.testKprobes(names[:half]) + self.testKprobes(names[half:])
 	def setVal(self, val, file, mode='w'):
 		if not os.path.exists(file):
 			return False
@@ -882,6 +994,8 @@ class Data:
 	devpids = []
 	kerror = False
 	battery = 0
+	cgstats = 0
+	devtimes = 0
 	phasedef = {
 		'suspend_prepare': {'order': 0, 'color': '#CCFFCC'},
 		        'suspend': {'order': 1, 'color': '#88FF88'},
@@ -1104,6 +1218,17 @@ class Data:
 					continue
 				for data in testlist:
 					data.usurpTouchingThread(devname, dev)
+	def optimizeCallgraphs(self):
+		# fold the call loops in every device callgraph
+		for phase in self.sortedPhases():
+			list = self.dmesg[phase]['list']
+			for devname in list:
+				dev = list[devname]
+				if 'ftrace' in dev:
+					dev['ftrace'].foldLoops()
+				if 'ftraces' in dev:
+					for cg in dev['ftraces']:
+						cg.foldLoops()
 	def optimizeDevSrc(self):
 		# merge any src call loops to reduce timeline size
 		for phase in self.sortedPhases():
@@ -1516,6 +1641,38 @@ class Data:
 				dev = list[devname]
 				if 'ftrace' in dev:
 					dev['ftrace'].debugPrint(' [%s]' % devname)
+	def callgraphStats(self):
+		# total (inclusive) and self (exclusive) time and call count of each
+		# function in the callgraphs, summed per device, per phase, and for
+		# the whole test in one pass: {func: [calls, total, self]}
+		test, phases, devs = dict(), dict(), dict()
+		for p in self.sortedPhases():
+			list = self.dmesg[p]['list']
+			phases[p] = dict()
+			for devname in list:
+				dev = list[devname]
+				cglist = []
+				if 'ftrace' in dev:
+					cglist.append(dev['ftrace'])
+				if 'ftraces' in dev:
+					cglist += dev['ftraces']
+				if len(cglist) < 1:
+					continue
+				devs[(p, devname)] = dict()
+				for cg in cglist:
+					for stack, line, selftime in cg.walk():
+						# recursive calls are already in the outer call's total
+						total = line.length
+						if line.name in stack[:-1]:
+							total = 0.0
+						for tgt in [devs[(p, devname)], phases[p], test]:
+							if line.name not in tgt:
+								tgt[line.name] = [0, 0.0, 0.0]
+							st = tgt[line.name]
+							st[0] += line.count
+							st[1] += total
+							st[2] += selftime
+		return {'test': test, 'phase': phases, 'dev': devs}
 
 # Class: DevFunction
 # Description:
@@ -1586,6 +1743,7 @@ class FTraceLine:
 	depth = 0
 	name = ''
 	type = ''
+	count = 1
 	def __init__(self, t, m='', d=''):
 		self.time = float(t)
 		if not m and not d:
@@ -1954,6 +2112,83 @@ class FTraceCallGraph:
 			return False
 		# trace ended before call tree finished
 		return self.repair(cnt)
+	def foldLoops(self):
+		# merge identical consecutive sibling subtrees (e.g. a udelay or readl
+		# loop) into the first one, summing their lengths and call counts
+		maxgap, maxlen = self.sv.callloopmaxgap, self.sv.callloopmaxlen
+		list = self.list
+		n = len(list)
+		# find the last line, end time, and raw length of each subtree
+		last, tend, rlen = [0] * n, [0.0] * n, [0.0] * n
+		stack = []
+		for i in range(n):
+			l = list[i]
+			rlen[i] = l.length
+			if l.isCall():
+				stack.append(i)
+			elif l.isReturn():
+				if len(stack) < 1:
+					return False
+				j = stack.pop()
+				last[j], tend[j] = i, l.time
+			else:
+				last[i], tend[i] = i, l.time + l.length
+		if len(stack) > 0:
+			return False
+		keep = [True] * n
+		for i in range(n):
+			if not keep[i] or list[i].isReturn() or rlen[i] >= maxlen:
+				continue
+			size = last[i] - i
+			# r is the last unmerged iteration, j is the candidate
+			r, j = i, last[i] + 1
+			while j < n and last[j] - j == size and rlen[j] < maxlen and \
+				0 <= list[j].time - tend[r] <= maxgap:
+				same = True
+				for k in range(size + 1):
+					a, b = list[r+k], list[j+k]
+					if a.name != b.name or a.depth != b.depth or \
+						a.fcall != b.fcall or a.freturn != b.freturn or \
+						a.count != b.count:
+						same = False
+						break
+				if not same:
+					break
+				for k in range(size + 1):
+					a, b = list[i+k], list[j+k]
+					a.length += b.length
+					a.count += b.count
+					keep[j+k] = False
+				r, j = j, last[j] + 1
+		if False in keep:
+			self.list = [list[i] for i in range(n) if keep[i]]
+		return True
+	def walk(self):
+		# a single pass over the list using depth, yields the call stack,
+		# the line, and its self time for each completed call or leaf
+		names, calls, child = [], [], []
+		for l in self.list:
+			d = l.depth
+			if l.isReturn():
+				if d >= len(calls):
+					continue
+				cl = calls[d]
+				stack = names[:d+1]
+				selftime = max(cl.length - child[d], 0.0)
+				del names[d:], calls[d:], child[d:]
+				if d > 0:
+					child[d-1] += cl.length
+				yield (stack, cl, selftime)
+				continue
+			del names[d:], calls[d:], child[d:]
+			if l.isLeaf():
+				if d > 0 and d <= len(child):
+					child[d-1] += l.length
+				yield (names + [l.name], l, l.length)
+			elif l.isCall():
+				names.append(l.name)
+				calls.append(l)
+				child.append(0.0)
 	def deviceMatch(self, pid, data):
 		found = ''
 		# add the callgraph data to the device hierarchy
@@ -2364,6 +2599,155 @@ class TestProps:
 		if not sv.stamp:
 			sv.stamp = data.stamp
 
+# Class: TraceEventMatcher
+# Description:
+#	 A table driven matcher for the event lines of a nop tracer log. Each
+#	 event is registered by name with its own regex and handler, the regex
+#	 is compiled once, and a line is dispatched on its event name (the text
+#	 before the first ':' of the message) so only that one regex is run.
+#	 Events which aren't registered cost a dict lookup. linefmt is the
+#	 compiled nop tracer line format for splitting a line into its fields.
+class TraceEventMatcher:
+	linefmt = re.compile(TestProps.ftrace_line_fmt_nop)
+	def __init__(self):
+		self.events = dict()
+	def addEvent(self, name, fmt, handler):
+		# handler(ktime, m) is called with the match of fmt on the message
+		self.events[name] = (re.compile(fmt), handler)
+	def dispatch(self, ktime, msg):
+		# run the handler of the message's event, True if one matched
+		i = msg.find(':')
+		if i < 1 or msg[:i] not in self.events:
+			return False
+		fmt, handler = self.events[msg[:i]]
+		m = fmt.match(msg)
+		if not m:
+			return False
+		handler(ktime, m)
+		return True
+
+# Class: WakeSourceStats
+# Description:
+#	 Hold and contention analysis of wakeup sources or wakelocks, fed by
+#	 their acquire/release events in one linear pass. Each source keeps a
+#	 stack of its open acquires so nested or repeated acquires pair up with
+#	 their releases, and the outer hold intervals. Per source: the number
+#	 of holds and acquires, total and max hold time, and exclusive time
+#	 (held by it alone, so it was the one thing keeping the system awake).
+#	 Overall: the time any source was held, by how many at once, and with
+#	 suspend() fed by the suspend_resume events, the sources held at each
+#	 suspend entry or acquired during a suspend (which aborts it).
+class WakeSourceStats:
+	def __init__(self, name):
+		self.name = name
+		self.sources = dict()
+		self.active = dict()
+		self.concurrent = dict()
+		self.last = -1.0
+		self.held = 0.0
+		self.maxactive = 0
+		self.suspending = False
+		self.suspends = 0
+		self.orphans = 0
+		self.unfinished = 0
+	def source(self, name):
+		if name not in self.sources:
+			self.sources[name] = {'name': name, 'stack': [], 'holds': 0,
+				'acquires': 0, 'total': 0.0, 'max': 0.0, 'exclusive': 0.0,
+				'atsuspend': 0, 'insuspend': 0, 'starts': [], 'ends': []}
+		return self.sources[name]
+	def advance(self, ktime):
+		# charge the time since the last event to the sources held in it
+		n = len(self.active)
+		if n > 0 and ktime > self.last:
+			dt = ktime - self.last
+			self.held += dt
+			self.concurrent[n] = self.concurrent.get(n, 0.0) + dt
+			if n == 1:
+				for s in self.active.values():
+					s['exclusive'] += dt
+		self.last = ktime
+	def close(self, s, ktime):
+		start = s['stack'][0]
+		s['stack'] = []
+		del self.active[s['name']]
+		hold = ktime - start
+		s['holds'] += 1
+		s['total'] += hold
+		s['max'] = max(s['max'], hold)
+		s['starts'].append(start)
+		s['ends'].append(ktime)
+	def acquire(self, name, ktime):
+		self.advance(ktime)
+		s = self.source(name)
+		s['acquires'] += 1
+		if self.suspending:
+			s['insuspend'] += 1
+		if not s['stack']:
+			self.active[name] = s
+			self.maxactive = max(self.maxactive, len(self.active))
+		s['stack'].append(ktime)
+	def release(self, name, ktime):
+		self.advance(ktime)
+		if name not in self.sources or not self.sources[name]['stack']:
+			self.orphans += 1
+			return
+		s = self.sources[name]
+		if len(s['stack']) > 1:
+			s['stack'].pop()
+		else:
+			self.close(s, ktime)
+	def suspend(self, ktime, begin):
+		self.advance(ktime)
+		if begin and not self.suspending:
+			self.suspends += 1
+			for s in self.active.values():
+				s['atsuspend'] += 1
+		self.suspending = begin
+	def finish(self, ktime):
+		# holds still open at the end of the trace are cut off there
+		self.advance(ktime)
+		for s in self.active.values():
+			self.unfinished += 1
+			self.close(s, ktime)
+	def top(self, count=20, key='total'):
+		list = sorted(self.sources.values(), key=lambda s:s[key], reverse=True)
+		return list[:count] if count > 0 else list
+	def strip(self, name, t0, tMax, bins):
+		# the holds of a source resampled to bins equal slots, a slot is set
+		# if any hold touches it, merged into (start slot, slot count)
+		s = self.sources[name]
+		width = (tMax - t0) / bins
+		out = []
+		if width <= 0:
+			return out
+		for i in range(len(s['starts'])):
+			b0 = min(max(int((s['starts'][i] - t0) / width), 0), bins - 1)
+			b1 = min(max(int((s['ends'][i] - t0) / width), 0), bins - 1)
+			if out and out[-1][0] + out[-1][1] >= b0:
+				out[-1][1] = max(out[-1][1], b1 - out[-1][0] + 1)
+			else:
+				out.append([b0, b1 - b0 + 1])
+		return out
+	def printReport(self, count=20):
+		if not self.sources:
+			return
+		print('%s: %d sources, %d holds, held %.3f ms, at most %d at once, '\
+			'%d suspends, %d unpaired releases, %d holds open at the end' % \
+			(self.name, len(self.sources), sum([s['holds'] for s in \
+			self.sources.values()]), self.held * 1000, self.maxactive,
+			self.suspends, self.orphans, self.unfinished))
+		for n in sorted(self.concurrent):
+			print('  %3d held: %12.3f ms' % (n, self.concurrent[n] * 1000))
+		fmt = '%-32s %7s %8s %12s %10s %10s %12s %9s %9s'
+		print(fmt % ('Source', 'Holds', 'Acquires', 'Total(ms)', 'Max(ms)',
+			'Avg(ms)', 'Alone(ms)', 'AtSusp', 'InSusp'))
+		for s in self.top(count):
+			print(fmt % (s['name'][:32], s['holds'], s['acquires'],
+				'%.3f' % (s['total'] * 1000), '%.3f' % (s['max'] * 1000),
+				'%.3f' % (s['total'] * 1000 / max(s['holds'], 1)),
+				'%.3f' % (s['exclusive'] * 1000), s['atsuspend'], s['insuspend']))
+
 # Class: TestRun
 # Description:
 #	 A container for a suspend/resume test run. This is necessary as
@@ -2422,6 +2806,63 @@ class ProcessMonitor:
 	def stop(self):
 		self.running = False
 
+# Class: SummaryStat
+# Description:
+#	 Streaming statistics for one timing value across a set of tests.
+#	 Min/max/avg and their row indices are kept as values are added,
+#	 the median and percentiles are found by selection, not sorting.
+class SummaryStat:
+	def __init__(self):
+		self.num = 0
+		self.total = 0.0
+		self.min = self.max = 0.0
+		self.imin = self.imax = -1
+		self.vals = []
+		self.rows = []
+	def add(self, val, row):
+		if self.num == 0 or val < self.min:
+			self.min, self.imin = val, row
+		if self.num == 0 or val > self.max:
+			self.max, self.imax = val, row
+		self.total += val
+		self.num += 1
+		self.vals.append(val)
+		self.rows.append(row)
+	def avg(self):
+		return self.total / self.num if self.num > 0 else 0.0
+	def select(self, k):
+		# quickselect the kth smallest value, return it and its first row
+		v = self.vals[:]
+		lo, hi = 0, len(v) - 1
+		while lo < hi:
+			pivot = v[(lo + hi) / 2]
+			i, j = lo, hi
+			while i <= j:
+				while v[i] < pivot:
+					i += 1
+				while v[j] > pivot:
+					j -= 1
+				if i <= j:
+					v[i], v[j] = v[j], v[i]
+					i += 1
+					j -= 1
+			if k <= j:
+				hi = j
+			elif k >= i:
+				lo = i
+			else:
+				break
+		return (v[k], self.rows[self.vals.index(v[k])])
+	def median(self):
+		if self.num < 1:
+			return (0.0, -1)
+		return self.select(self.num / 2)
+	def percentile(self, pct):
+		if self.num < 1:
+			return (0.0, -1)
+		# nearest rank
+		return self.select(max((pct * self.num + 99) / 100 - 1, 0))
+
 # ----------------- FUNCTIONS --------------------
 
 # Function: doesTraceLogHaveTraceEvents
@@ -3397,6 +3838,7 @@ def callgraphHTML(sv, hf, num, cg, title, color, devid):
 	html_func_start = '<article>\n<input type="checkbox" class="pf" id="f{0}" checked/><label for="f{0}">{1} {2}</label>\n'
 	html_func_end = '</article>\n'
 	html_func_leaf = '<article>{0} {1}</article>\n'
+	html_func_blob = '<div class="cgz hide">{0}</div>\n'
 
 	cgid = devid
 	if cg.id:
@@ -3407,7 +3849,16 @@ def callgraphHTML(sv, hf, num, cg, title, color, devid):
 
 	fmt = '<r>(%.3f ms @ '+sv.timeformat+' to '+sv.timeformat+')</r>'
 	flen = fmt % (cglen, cg.start, cg.end)
-	hf.write(html_func_top.format(cgid, color, num, title, flen))
+	if sv.cglazy:
+		# write the top collapsed, the body goes into a compressed blob
+		top = html_func_top.format(cgid, color, num, title, flen)
+		if sv.cgexp:
+			top = top.replace(' checked/>', '/>', 1)
+		hf.write(top)
+		out = StringIO()
+	else:
+		hf.write(html_func_top.format(cgid, color, num, title, flen))
+		out = hf
 	num += 1
 	for line in cg.list:
 		if(line.length < 0.000000001):
@@ -3415,13 +3866,19 @@ def callgraphHTML(sv, hf, num, cg, title, color, devid):
 		else:
 			fmt = '<n>(%.3f ms @ '+sv.timeformat+')</n>'
 			flen = fmt % (line.length*1000, line.time)
+		name = line.name
+		if line.count > 1:
+			name += ' &times;%d' % line.count
 		if line.isLeaf():
-			hf.write(html_func_leaf.format(line.name, flen))
+			out.write(html_func_leaf.format(name, flen))
 		elif line.freturn:
-			hf.write(html_func_end)
+			out.write(html_func_end)
 		else:
-			hf.write(html_func_start.format(num, line.name, flen))
+			out.write(html_func_start.format(num, name, flen))
 			num += 1
+	if sv.cglazy:
+		hf.write(html_func_blob.format(base64.b64encode(zlib.compress(out.getvalue(), 9))))
+		out.close()
 	hf.write(html_func_end)
 	return num
 
@@ -3457,6 +3914,443 @@ def addCallgraphs(sv, hf, data):
 						name+' &rarr; '+cg.name, color, dev['id'])
 	hf.write('\n\n    </section>\n')
 
+# Function: htmlEscape
+# Description:
+#	 Escape the html special characters in text taken from a log or database
+def htmlEscape(text):
+	return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+# Function: addLogHTML
+# Description:
+#	 Copy a log file into the html output as a hidden div. The log is read
+#	 and escaped a block at a time, and with ziplogs it's stored as a
+#	 gzip+base64 blob which the page inflates when the log is opened.
+# Arguments:
+#	 sv: the SystemValues object
+#	 hf: the open html file
+#	 name: the id of the div (e.g. dmesglog)
+#	 file: the log file to copy
+#	 size: only copy the first size bytes of the file, -1 for all of it
+def addLogHTML(sv, hf, name, file, size=-1):
+	lf = sv.openlog(file, 'r')
+	if sv.ziplogs:
+		hf.write('<div id="%s" class="logz" style="display:none;">' % name)
+		z = zlib.compressobj(9, zlib.DEFLATED, 31)
+		pend = z.compress('\n')
+	else:
+		hf.write('<div id="%s" style="display:none;">\n' % name)
+		z = None
+	while size != 0:
+		block = lf.read(1048576 if size < 0 else min(size, 1048576))
+		if not block:
+			break
+		if size > 0:
+			size -= len(block)
+		block = htmlEscape(block)
+		if not z:
+			hf.write(block)
+			continue
+		# base64 is only concatenable in 3 byte groups, carry the rest
+		pend += z.compress(block)
+		cut = len(pend) - (len(pend) % 3)
+		hf.write(base64.b64encode(pend[:cut]))
+		pend = pend[cut:]
+	if z:
+		hf.write(base64.b64encode(pend + z.flush()))
+	lf.close()
+	hf.write('</div>\n')
+
+# Function: createFlameGraphFiles
+# Description:
+#	 Export the device callgraphs in folded stack format (one line per
+#	 unique stack with its self time in us) for use with flame graph tools,
+#	 along with the total self time and call count of each function.
+#	 The files are named after the html file: *_folded.txt, *_selftime.txt
+# Arguments:
+#	 sv: the SystemValues object
+#	 testruns: array of Data objects with callgraphs
+def createFlameGraphFiles(sv, testruns):
+	base = sv.htmlfile
+	if base.endswith('.html'):
+		base = base[:-5]
+	stacks = dict()
+	funcs = dict()
+	for data in testruns:
+		for p in data.sortedPhases():
+			list = data.dmesg[p]['list']
+			for devname in sorted(list, key=lambda k:list[k]['start']):
+				dev = list[devname]
+				cglist = []
+				if 'ftrace' in dev:
+					cglist.append(dev['ftrace'])
+				if 'ftraces' in dev:
+					cglist += dev['ftraces']
+				prefix = '%s;%s;' % (p, devname.replace(';', ':'))
+				for cg in cglist:
+					for stack, line, selftime in cg.walk():
+						key = prefix + ';'.join(stack)
+						if key not in stacks:
+							stacks[key] = 0.0
+						stacks[key] += selftime
+						if line.name not in funcs:
+							funcs[line.name] = [0.0, 0]
+						funcs[line.name][0] += selftime
+						funcs[line.name][1] += line.count
+	if len(stacks) < 1:
+		sv.vprint('No callgraph data for the flame graph files')
+		return
+	fp = open(base+'_folded.txt', 'w')
+	for key in sorted(stacks):
+		us = int(round(stacks[key] * 1000000))
+		if us > 0:
+			fp.write('%s %d\n' % (key, us))
+	fp.close()
+	fp = open(base+'_selftime.txt', 'w')
+	fp.write('%12s %10s  %s\n' % ('Self(ms)', 'Calls', 'Function'))
+	for name in sorted(funcs, key=lambda k:funcs[k][0], reverse=True):
+		fp.write('%12.3f %10d  %s\n' % (funcs[name][0] * 1000, funcs[name][1], name))
+	fp.close()
+	sv.vprint('Flame graph data: %s_folded.txt, %s_selftime.txt' % (base, base))
+
+# Function: topFunctions
+# Description:
+#	 Sort a callgraphStats function table by self time, largest first
+# Arguments:
+#	 funcs: dict of {func: [calls, total, self]}
+#	 count: the maximum number of entries to return, 0 for all
+def topFunctions(funcs, count=0):
+	out = sorted(funcs, key=lambda k:funcs[k][2], reverse=True)
+	if count > 0:
+		return out[:count]
+	return out
+
+# Function: addCallgraphStats
+# Description:
+#	 Write the top N functions by self time for each test, phase, and
+#	 device as collapsible tables below the callgraphs
+# Arguments:
+#	 sv: the SystemValues object
+#	 hf: the open html file
+#	 testruns: array of Data objects with callgraphStats in data.cgstats
+def addCallgraphStats(sv, hf, testruns):
+	html_top = '<article class="atop" style="background:{0}">\n<input type="checkbox" class="pf" id="s{1}" checked/><label for="s{1}">{2}</label>\n'
+	html_start = '<article>\n<input type="checkbox" class="pf" id="s{0}" checked/><label for="s{0}">{1}</label>\n'
+	html_end = '</article>\n'
+	html_row = '<tr><td>{0}</td><td>{1}</td><td>{2:.3f}</td><td>{3:.3f}</td></tr>\n'
+	def table(funcs):
+		html = '<table class="cgstat">\n<tr><th>Function</th><th>Calls</th><th>Total(ms)</th><th>Self(ms)</th></tr>\n'
+		for f in topFunctions(funcs, sv.cgstats):
+			calls, total, selftime = funcs[f]
+			html += html_row.format(f, calls, total*1000, selftime*1000)
+		return html+'</table>\n'
+	hf.write('<section id="cgstats" class="callgraph">\n')
+	num = 0
+	for data in testruns:
+		if not data.cgstats or len(data.cgstats['test']) < 1:
+			continue
+		stats = data.cgstats
+		title = 'Top %d functions by self time' % sv.cgstats
+		if len(testruns) > 1:
+			title = ordinal(data.testnumber+1)+' test: '+title
+		hf.write(html_top.format('#eee', num, title))
+		hf.write(table(stats['test']))
+		num += 1
+		for p in data.sortedPhases():
+			if len(stats['phase'][p]) < 1:
+				continue
+			hf.write(html_start.format(num, p))
+			hf.write(table(stats['phase'][p]))
+			num += 1
+			list = data.dmesg[p]['list']
+			for devname in sorted(list, key=lambda k:list[k]['start']):
+				if (p, devname) not in stats['dev']:
+					continue
+				name = devname
+				if(devname in sv.devprops):
+					name = sv.devprops[devname].altName(devname)
+				hf.write(html_start.format(num, name))
+				hf.write(table(stats['dev'][(p, devname)]))
+				hf.write(html_end)
+				num += 1
+			hf.write(html_end)
+		hf.write(html_end)
+	hf.write('</section>\n')
+
+# Function: createCallgraphStatsFile
+# Description:
+#	 Export the callgraphStats tables of all tests as csv next to the html
+#	 (*_cgstats.csv). An empty phase or device field is the total for that
+#	 test or phase.
+# Arguments:
+#	 sv: the SystemValues object
+#	 testruns: array of Data objects with callgraphStats in data.cgstats
+def createCallgraphStatsFile(sv, testruns):
+	base = sv.htmlfile
+	if base.endswith('.html'):
+		base = base[:-5]
+	fp = open(base+'_cgstats.csv', 'wb')
+	cw = csv.writer(fp)
+	cw.writerow(['Test', 'Phase', 'Device', 'Function', 'Calls', 'Total(ms)', 'Self(ms)'])
+	def rows(test, phase, dev, funcs):
+		for f in topFunctions(funcs):
+			calls, total, selftime = funcs[f]
+			cw.writerow([test, phase, dev, f, calls, '%.3f' % (total*1000),
+				'%.3f' % (selftime*1000)])
+	for data in testruns:
+		if not data.cgstats:
+			continue
+		stats = data.cgstats
+		rows(data.testnumber, '', '', stats['test'])
+		for p in data.sortedPhases():
+			rows(data.testnumber, p, '', stats['phase'][p])
+			list = data.dmesg[p]['list']
+			for devname in sorted(list, key=lambda k:list[k]['start']):
+				if (p, devname) in stats['dev']:
+					rows(data.testnumber, p, devname, stats['dev'][(p, devname)])
+	fp.close()
+	sv.vprint('Callgraph statistics: %s_cgstats.csv' % base)
+
+# Function: createResultJSON
+# Description:
+#	 Write the test results next to the html file (*_result.json) so that
+#	 a summary can be built without scraping the html. Holds the stamp,
+#	 suspend/resume times, errors, the device durations drawn in the
+#	 timeline, and the phase durations of each test.
+# Arguments:
+#	 sv: the SystemValues object
+#	 testruns: array of Data objects drawn by createHTML
+#	 stamp: the test stamp returned by processData
+def createResultJSON(sv, testruns, stamp):
+	if sv.suspendmode == 'command' or not sv.htmlfile.endswith('.html'):
+		return
+	try:
+		dt = datetime.strptime(stamp['time'], '%B %d %Y, %I:%M:%S %p')
+	except:
+		return
+	issues = dict()
+	devices = dict()
+	phases = []
+	for data in testruns:
+		for dir in data.errorinfo:
+			for e in data.errorinfo[dir]:
+				issues[e[0]] = issues[e[0]] + 1 if e[0] in issues else 1
+		if data.devtimes:
+			devices.update(data.devtimes)
+		plist = dict()
+		for p in data.sortedPhases():
+			plist[p] = float('%.3f' % \
+				((data.dmesg[p]['end'] - data.dmesg[p]['start']) * 1000))
+		phases.append(plist)
+	ilist = []
+	for i in sorted(issues):
+		ilist.append('%sx%d' % (i, issues[i]) if issues[i] > 1 else i)
+	wd, wdt = '', 0
+	if len(devices) > 0:
+		wd = sorted(devices, key=devices.get, reverse=True)[0]
+		wdt = devices[wd]
+	out = {
+		'mode': stamp['mode'],
+		'host': stamp['host'],
+		'kernel': stamp['kernel'],
+		'time': dt.strftime('%Y/%m/%d %H:%M:%S'),
+		'result': 'fail' if 'error' in stamp else 'pass',
+		'error': stamp['error'] if 'error' in stamp else '',
+		'issues': ' '.join(ilist),
+		'suspend': float('%.3f' % stamp['suspend']),
+		'resume': float('%.3f' % stamp['resume']),
+		'worst': wd,
+		'worsttime': wdt,
+		'devices': devices,
+		'phases': phases,
+	}
+	if 'fwsuspend' in stamp:
+		out['fwsuspend'] = stamp['fwsuspend']
+		out['fwresume'] = stamp['fwresume']
+	fp = open(sv.htmlfile[:-5]+'_result.json', 'w')
+	json.dump(out, fp, sort_keys=True)
+	fp.close()
+
+# Function: devdbOpen
+# Description:
+#	 Open the device regression database, creating the tables if needed.
+#	 Each test run is a row in test, each device callback a row in device.
+# Arguments:
+#	 file: the sqlite database file
+# Output:
+#	 an open sqlite3 connection
+def devdbOpen(file):
+	db = sqlite3.connect(file, timeout=60)
+	db.execute('PRAGMA journal_mode=WAL')
+	db.execute('PRAGMA synchronous=NORMAL')
+	db.executescript('''
+		CREATE TABLE IF NOT EXISTS test (id INTEGER PRIMARY KEY,
+			host TEXT, kernel TEXT, mode TEXT, time TEXT, num INTEGER,
+			result TEXT, suspend REAL, resume REAL);
+		CREATE TABLE IF NOT EXISTS device (test INTEGER, name TEXT,
+			phase TEXT, driver TEXT, time REAL);
+		CREATE INDEX IF NOT EXISTS test_hmk ON test (host, mode, kernel, time);
+		CREATE INDEX IF NOT EXISTS device_test ON device (test);
+		CREATE INDEX IF NOT EXISTS device_name ON device (name, phase);
+	''')
+	return db
+
+# Function: devdbInsert
+# Description:
+#	 Add the device callback times of every test run to the device database
+#	 in one transaction. A rerun of the same log replaces its old rows.
+# Arguments:
+#	 sv: the sysvals object, sv.devdb is the database file
+#	 testruns: array of Data objects from parseTraceLog
+#	 stamp: the stamp of the first test run, as returned by processData
+def devdbInsert(sv, testruns, stamp):
+	if sv.suspendmode == 'command':
+		return
+	try:
+		dt = datetime.strptime(stamp['time'], '%B %d %Y, %I:%M:%S %p')
+	except:
+		return
+	tstr = dt.strftime('%Y/%m/%d %H:%M:%S')
+	key = (stamp['host'], stamp['mode'], tstr)
+	result = 'fail' if 'error' in stamp else 'pass'
+	try:
+		db = devdbOpen(sv.devdb)
+		with db:
+			db.execute('DELETE FROM device WHERE test IN (SELECT id FROM test '+\
+				'WHERE host=? AND mode=? AND time=?)', key)
+			db.execute('DELETE FROM test WHERE host=? AND mode=? AND time=?', key)
+			for data in testruns:
+				sktime, rktime = data.getTimeValues()
+				cur = db.execute('INSERT INTO test (host, kernel, mode, time, '+\
+					'num, result, suspend, resume) VALUES (?,?,?,?,?,?,?,?)',
+					(stamp['host'], stamp['kernel'], stamp['mode'], tstr,
+					data.testnumber, result, sktime, rktime))
+				id, rows = cur.lastrowid, []
+				for phase in data.sortedPhases():
+					list = data.dmesg[phase]['list']
+					for name in list:
+						dev = list[name]
+						# only device callbacks, not threads or processes
+						if ('htmlclass' in dev and dev['htmlclass']) or \
+							dev['start'] < 0 or dev['end'] < dev['start']:
+							continue
+						drv = dev['drv'] if 'drv' in dev else ''
+						rows.append((id, name, phase, drv,
+							(dev['end'] - dev['start']) * 1000))
+				db.executemany('INSERT INTO device (test, name, phase, '+\
+					'driver, time) VALUES (?,?,?,?,?)', rows)
+		db.close()
+	except sqlite3.Error as e:
+		print('WARNING: device database %s: %s' % (sv.devdb, e))
+		return
+	sv.vprint('Device database updated (%s)' % sv.devdb)
+
+# Function: devdbStats
+# Description:
+#	 Load the device times of all passing tests of one kernel
+# Output:
+#	 dict of (name, phase) -> SummaryStat of the callback times in ms
+def devdbStats(db, host, mode, kernel):
+	stats = dict()
+	for name, phase, time in db.execute('SELECT d.name, d.phase, d.time '+\
+		'FROM device d JOIN test t ON d.test = t.id WHERE t.host=? AND '+\
+		't.mode=? AND t.kernel=? AND t.result=\'pass\'', (host, mode, kernel)):
+		key = (name, phase)
+		if key not in stats:
+			stats[key] = SummaryStat()
+		stats[key].add(time, 0)
+	return stats
+
+# Function: devdbReport
+# Description:
+#	 Compare the two most recently tested kernels of each host/mode in
+#	 the device database and report the devices whose p50/p95 callback
+#	 times moved the most, to stdout and to an html file.
+# Arguments:
+#	 dbfile: the sqlite database file
+#	 htmlfile: the html report file
+#	 count: the number of devices to report per host/mode
+def devdbReport(dbfile, htmlfile, count=20):
+	db = devdbOpen(dbfile)
+	report = []
+	for host, mode in db.execute('SELECT DISTINCT host, mode FROM test '+\
+		'ORDER BY host, mode').fetchall():
+		klist = db.execute('SELECT kernel, MAX(time) AS last FROM test '+\
+			'WHERE host=? AND mode=? AND result=\'pass\' GROUP BY kernel '+\
+			'ORDER BY last DESC LIMIT 2', (host, mode)).fetchall()
+		if len(klist) < 2:
+			continue
+		new, old = klist[0][0], klist[1][0]
+		sold = devdbStats(db, host, mode, old)
+		snew = devdbStats(db, host, mode, new)
+		movers = []
+		for key in snew:
+			if key not in sold:
+				continue
+			a, b = sold[key], snew[key]
+			p50 = (a.median()[0], b.median()[0])
+			p95 = (a.percentile(95)[0], b.percentile(95)[0])
+			move = max(abs(p50[1] - p50[0]), abs(p95[1] - p95[0]))
+			movers.append((move, key, a.num, b.num, p50, p95))
+		movers.sort(key=lambda v:v[0], reverse=True)
+		report.append((host, mode, old, new, movers[:count]))
+	db.close()
+	if len(report) < 1:
+		print('No host/mode in %s has two kernels to compare' % dbfile)
+		return
+
+	# text report
+	fmt = '%-40s %-16s %9s %9s %9s %9s %9s %9s'
+	for host, mode, old, new, movers in report:
+		print('%s %s: %s -> %s' % (host, mode, old, new))
+		print(fmt % ('Device', 'Phase', 'P50', 'P50', 'dP50', 'P95', 'P95', 'dP95'))
+		for move, key, na, nb, p50, p95 in movers:
+			print(fmt % (key[0][:40], key[1], '%.3f' % p50[0], '%.3f' % p50[1],
+				'%+.3f' % (p50[1] - p50[0]), '%.3f' % p95[0], '%.3f' % p95[1],
+				'%+.3f' % (p95[1] - p95[0])))
+		print('')
+
+	# html report
+	hf = open(htmlfile, 'w')
+	hf.write('<!DOCTYPE html>\n<html>\n<head>\n\
+	<meta http-equiv="content-type" content="text/html; charset=UTF-8">\n\
+	<title>SleepGraph Device Report</title>\n\
+	<style type=\'text/css\'>\n\
+		.stamp {width: 100%;text-align:center;background:#888;line-height:30px;color:white;font: 25px Arial;}\n\
+		table {width:100%;border-collapse: collapse;margin-bottom:20px;}\n\
+		.summary {border:1px solid;}\n\
+		th {border: 1px solid black;background:#222;color:white;}\n\
+		td {font: 14px "Times New Roman";text-align: center;}\n\
+		tr.head td {border: 1px solid black;background:#aaa;}\n\
+		tr.alt {background-color:#ddd;}\n\
+		.slower {color:red;}\n\
+		.faster {color:green;}\n\
+	</style>\n</head>\n<body>\n')
+	hf.write('<div class="stamp">%s</div>\n' % htmlEscape(dbfile))
+	th = '\t<th>{0}</th>\n'
+	td = '\t<td>{0}</td>\n'
+	tdd = '\t<td class={1}>{0}</td>\n'
+	for host, mode, old, new, movers in report:
+		hf.write('<table class="summary">\n<tr class="head"><td colspan=10>'+\
+			'%s %s: %s &rarr; %s</td></tr>\n<tr>\n' % (htmlEscape(host),
+			htmlEscape(mode), htmlEscape(old), htmlEscape(new)))
+		for h in ['Device', 'Phase', 'Tests', 'P50 old', 'P50 new', 'P50 change',
+			'P95 old', 'P95 new', 'P95 change']:
+			hf.write(th.format(h))
+		hf.write('</tr>\n')
+		for num, (move, key, na, nb, p50, p95) in enumerate(movers):
+			html = '<tr class="alt">\n' if num % 2 == 1 else '<tr>\n'
+			html += td.format(htmlEscape(key[0])) + td.format(htmlEscape(key[1]))
+			html += td.format('%d / %d' % (na, nb))
+			for v in [p50, p95]:
+				d = v[1] - v[0]
+				html += td.format('%.3f ms' % v[0]) + td.format('%.3f ms' % v[1])
+				html += tdd.format('%+.3f ms' % d, 'slower' if d > 0 else 'faster')
+			hf.write(html+'</tr>\n')
+		hf.write('</table>\n')
+	hf.write('</body>\n</html>\n')
+	hf.close()
+	print('Device report file: %s' % htmlfile)
+
 # Function: createHTMLSummarySimple
 # Description:
 #	 Create summary html file for a series of tests
@@ -3464,7 +4358,8 @@ def addCallgraphs(sv, hf, data):
 #	 testruns: array of Data objects from parseTraceLog
 def createHTMLSummarySimple(testruns, htmlfile, folder):
 	# write the html header first (html head, css code, up to body start)
-	html = '<!DOCTYPE html>\n<html>\n<head>\n\
+	hf = open(htmlfile, 'w')
+	hf.write('<!DOCTYPE html>\n<html>\n<head>\n\
 	<meta http-equiv="content-type" content="text/html; charset=UTF-8">\n\
 	<title>SleepGraph Summary</title>\n\
 	<style type=\'text/css\'>\n\
@@ -3480,31 +4375,18 @@ def createHTMLSummarySimple(testruns, htmlfile, folder):
 		.medval {background-color:#BBBBFF;}\n\
 		.maxval {background-color:#FFBBBB;}\n\
 		.head a {color:#000;text-decoration: none;}\n\
-	</style>\n</head>\n<body>\n'
+		.pct {margin-top:20px;}\n\
+	</style>\n</head>\n<body>\n')
 
-	# extract the test data into list
+	# extract the test data into list, aggregate the passing timings
+	# per mode and per mode/host/kernel as the rows are added
 	list = dict()
-	tAvg, tMin, tMax, tMed = [0.0, 0.0], [0.0, 0.0], [0.0, 0.0], [[], []]
-	iMin, iMed, iMax = [0, 0], [0, 0], [0, 0]
-	num = 0
-	lastmode = ''
+	groups = dict()
 	cnt = dict()
 	for data in sorted(testruns, key=lambda v:(v['mode'], v['host'], v['kernel'], v['time'])):
 		mode = data['mode']
 		if mode not in list:
-			list[mode] = {'data': [], 'avg': [0,0], 'min': [0,0], 'max': [0,0], 'med': [0,0]}
-		if lastmode and lastmode != mode and num > 0:
-			for i in range(2):
-				s = sorted(tMed[i])
-				list[lastmode]['med'][i] = s[int(len(s)/2)]
-				iMed[i] = tMed[i].index(list[lastmode]['med'][i])
-			list[lastmode]['avg'] = [tAvg[0] / num, tAvg[1] / num]
-			list[lastmode]['min'] = tMin
-			list[lastmode]['max'] = tMax
-			list[lastmode]['idx'] = (iMin, iMed, iMax)
-			tAvg, tMin, tMax, tMed = [0.0, 0.0], [0.0, 0.0], [0.0, 0.0], [[], []]
-			iMin, iMed, iMax = [0, 0], [0, 0], [0, 0]
-			num = 0
+			list[mode] = {'data': [], 'stat': [SummaryStat(), SummaryStat()]}
 		tVal = [float(data['suspend']), float(data['resume'])]
 		list[mode]['data'].append([data['host'], data['kernel'],
 			data['time'], tVal[0], tVal[1], data['url'], data['result'],
@@ -3515,81 +4397,69 @@ def createHTMLSummarySimple(testruns, htmlfile, folder):
 		else:
 			cnt[data['result']] += 1
 		if data['result'] == 'pass':
+			key = (mode, data['host'], data['kernel'])
+			if key not in groups:
+				groups[key] = [SummaryStat(), SummaryStat()]
 			for i in range(2):
-				tMed[i].append(tVal[i])
-				tAvg[i] += tVal[i]
-				if tMin[i] == 0 or tVal[i] < tMin[i]:
-					iMin[i] = idx
-					tMin[i] = tVal[i]
-				if tMax[i] == 0 or tVal[i] > tMax[i]:
-					iMax[i] = idx
-					tMax[i] = tVal[i]
-			num += 1
-		lastmode = mode
-	if lastmode and num > 0:
-		for i in range(2):
-			s = sorted(tMed[i])
-			list[lastmode]['med'][i] = s[int(len(s)/2)]
-			iMed[i] = tMed[i].index(list[lastmode]['med'][i])
-		list[lastmode]['avg'] = [tAvg[0] / num, tAvg[1] / num]
-		list[lastmode]['min'] = tMin
-		list[lastmode]['max'] = tMax
-		list[lastmode]['idx'] = (iMin, iMed, iMax)
+				list[mode]['stat'][i].add(tVal[i], idx)
+				groups[key][i].add(tVal[i], idx)
 
 	# group test header
 	desc = []
 	for ilk in sorted(cnt, reverse=True):
 		if cnt[ilk] > 0:
 			desc.append('%d %s' % (cnt[ilk], ilk))
-	html += '<div class="stamp">%s (%d tests: %s)</div>\n' % (folder, len(testruns), ', '.join(desc))
+	hf.write('<div class="stamp">%s (%d tests: %s)</div>\n' % (folder, len(testruns), ', '.join(desc)))
 	th = '\t<th>{0}</th>\n'
 	td = '\t<td>{0}</td>\n'
 	tdh = '\t<td{1}>{0}</td>\n'
 	tdlink = '\t<td><a href="{0}">html</a></td>\n'
 
 	# table header
-	html += '<table class="summary">\n<tr>\n' + th.format('#') +\
+	hf.write('<table class="summary">\n<tr>\n' + th.format('#') +\
 		th.format('Mode') + th.format('Host') + th.format('Kernel') +\
 		th.format('Test Time') + th.format('Result') + th.format('Issues') +\
 		th.format('Suspend') + th.format('Resume') + th.format('Worst Device') +\
-		th.format('Worst Time') + th.format('Detail') + '</tr>\n'
+		th.format('Worst Time') + th.format('Detail') + '</tr>\n')
 
-	# export list into html
+	# export list into html, one row at a time
 	head = '<tr class="head"><td>{0}</td><td>{1}</td>'+\
 		'<td colspan=10 class="sus">Suspend Avg={2} '+\
-		'<span class=minval><a href="#s{10}min">Min={3}</a></span> '+\
-		'<span class=medval><a href="#s{10}med">Med={4}</a></span> '+\
-		'<span class=maxval><a href="#s{10}max">Max={5}</a></span> '+\
-		'Resume Avg={6} '+\
-		'<span class=minval><a href="#r{10}min">Min={7}</a></span> '+\
-		'<span class=medval><a href="#r{10}med">Med={8}</a></span> '+\
-		'<span class=maxval><a href="#r{10}max">Max={9}</a></span></td>'+\
+		'<span class=minval><a href="#s{14}min">Min={3}</a></span> '+\
+		'<span class=medval><a href="#s{14}med">Med={4}</a></span> '+\
+		'<span class=maxval><a href="#s{14}max">Max={5}</a></span> '+\
+		'P90={6} P99={7} '+\
+		'Resume Avg={8} '+\
+		'<span class=minval><a href="#r{14}min">Min={9}</a></span> '+\
+		'<span class=medval><a href="#r{14}med">Med={10}</a></span> '+\
+		'<span class=maxval><a href="#r{14}max">Max={11}</a></span> '+\
+		'P90={12} P99={13}</td>'+\
 		'</tr>\n'
 	headnone = '<tr class="head"><td>{0}</td><td>{1}</td><td colspan=10></td></tr>\n'
 	for mode in list:
 		# header line for each suspend mode
-		num = 0
-		tAvg, tMin, tMax, tMed = list[mode]['avg'], list[mode]['min'],\
-			list[mode]['max'], list[mode]['med']
+		stat = list[mode]['stat']
 		count = len(list[mode]['data'])
-		if 'idx' in list[mode]:
-			iMin, iMed, iMax = list[mode]['idx']
-			html += head.format('%d' % count, mode.upper(),
-				'%.3f' % tAvg[0], '%.3f' % tMin[0], '%.3f' % tMed[0], '%.3f' % tMax[0],
-				'%.3f' % tAvg[1], '%.3f' % tMin[1], '%.3f' % tMed[1], '%.3f' % tMax[1],
-				mode.lower()
-			)
+		iMin, iMed, iMax = [-1, -1], [-1, -1], [-1, -1]
+		if stat[0].num > 0:
+			hval = [count, mode.upper()]
+			for i in range(2):
+				med, iMed[i] = stat[i].median()
+				iMin[i], iMax[i] = stat[i].imin, stat[i].imax
+				hval += ['%.3f' % v for v in [stat[i].avg(), stat[i].min,
+					med, stat[i].max, stat[i].percentile(90)[0],
+					stat[i].percentile(99)[0]]]
+			hval.append(mode.lower())
+			hf.write(head.format(*hval))
 		else:
-			iMin = iMed = iMax = [-1, -1, -1]
-			html += headnone.format('%d' % count, mode.upper())
-		for d in list[mode]['data']:
+			hf.write(headnone.format('%d' % count, mode.upper()))
+		for idx, d in enumerate(list[mode]['data']):
 			# row classes - alternate row color
-			rcls = ['alt'] if num % 2 == 1 else []
+			rcls = ['alt'] if idx % 2 == 1 else []
 			if d[6] != 'pass':
 				rcls.append('notice')
-			html += '<tr class="'+(' '.join(rcls))+'">\n' if len(rcls) > 0 else '<tr>\n'
+			html = '<tr class="'+(' '.join(rcls))+'">\n' if len(rcls) > 0 else '<tr>\n'
 			# figure out if the line has sus or res highlighted
-			idx = list[mode]['data'].index(d)
 			tHigh = ['', '']
 			for i in range(2):
 				tag = 's%s' % mode if i == 0 else 'r%s' % mode
@@ -3599,7 +4469,7 @@ def createHTMLSummarySimple(testruns, htmlfile, folder):
 					tHigh[i] = ' id="%smax" class=maxval title="Maximum"' % tag
 				elif idx == iMed[i]:
 					tHigh[i] = ' id="%smed" class=medval title="Median"' % tag
-			html += td.format("%d" % (list[mode]['data'].index(d) + 1)) # row
+			html += td.format("%d" % (idx + 1))							# row
 			html += td.format(mode)										# mode
 			html += td.format(d[0])										# host
 			html += td.format(d[1])										# kernel
@@ -3611,12 +4481,28 @@ def createHTMLSummarySimple(testruns, htmlfile, folder):
 			html += td.format(d[8])										# worst
 			html += td.format('%.3f ms' % d[9])							# worst time
 			html += tdlink.format(d[5]) if d[5] else td.format('')		# url
-			html += '</tr>\n'
-			num += 1
-
-	# flush the data to file
-	hf = open(htmlfile, 'w')
-	hf.write(html+'</table>\n</body>\n</html>\n')
+			hf.write(html+'</tr>\n')
+	hf.write('</table>\n')
+
+	# percentiles of the passing tests per mode, host, and kernel
+	if len(groups) > 0:
+		hf.write('<table class="summary pct">\n<tr>\n' + th.format('Mode') +\
+			th.format('Host') + th.format('Kernel') + th.format('Tests') +\
+			th.format('Suspend Med') + th.format('Suspend P90') +\
+			th.format('Suspend P99') + th.format('Resume Med') +\
+			th.format('Resume P90') + th.format('Resume P99') + '</tr>\n')
+		for num, key in enumerate(sorted(groups)):
+			stat = groups[key]
+			html = '<tr class="alt">\n' if num % 2 == 1 else '<tr>\n'
+			html += td.format(key[0]) + td.format(key[1]) + td.format(key[2])
+			html += td.format('%d' % stat[0].num)
+			for i in range(2):
+				html += td.format('%.3f ms' % stat[i].median()[0])
+				html += td.format('%.3f ms' % stat[i].percentile(90)[0])
+				html += td.format('%.3f ms' % stat[i].percentile(99)[0])
+			hf.write(html+'</tr>\n')
+		hf.write('</table>\n')
+	hf.write('</body>\n</html>\n')
 	hf.close()
 
 def ordinal(value):
@@ -3647,6 +4533,7 @@ def createHTML(testruns, testfail):
 		if data.kerror:
 			kerror = True
 		data.normalizeTime(testruns[-1].tSuspended)
+		data.devtimes = dict()
 
 	# html function templates
 	html_error = '<div id="{1}" title="kernel error/warning" class="err" style="right:{0}%">{2}&rarr;</div>\n'
@@ -3861,19 +4748,27 @@ def createHTML(testruns, testfail):
 					left = '%f' % (((dev['start']-m0)*100)/mTotal)
 					width = '%f' % (((dev['end']-dev['start'])*100)/mTotal)
 					length = ' (%0.3f ms) ' % ((dev['end']-dev['start'])*1000)
-					title = name+drv+xtrainfo+length
 					if sysvals.suspendmode == 'command':
-						title += sysvals.testcommand
+						tail = sysvals.testcommand
 					elif xtraclass == ' ps':
 						if 'suspend' in b:
-							title += 'pre_suspend_process'
+							tail = 'pre_suspend_process'
 						else:
-							title += 'post_resume_process'
+							tail = 'post_resume_process'
 					else:
-						title += b
+						tail = b
+					title = name+drv+xtrainfo+length+tail
 					devtl.html += devtl.html_device.format(dev['id'], \
 						title, left, top, '%.3f'%rowheight, width, \
 						d+drv, xtraclass, xtrastyle)
+					# keep the drawn durations for the result sidecar
+					if not xtraclass.startswith(' kth') and \
+						not xtraclass.startswith(' sec'):
+						dname = name+drv
+						if xtrainfo not in [' async_device', ' sync_device']:
+							dname += xtrainfo
+						data.devtimes[dname+' '+tail] = \
+							float('%0.3f' % ((dev['end']-dev['start'])*1000))
 					if('cpuexec' in dev):
 						for t in sorted(dev['cpuexec']):
 							start, end = t
@@ -3957,27 +4852,18 @@ def createHTML(testruns, testfail):
 		data = testruns[-1]
 	if sysvals.usecallgraph:
 		addCallgraphs(sysvals, hf, data)
+	if sysvals.usecallgraph and sysvals.cgstats:
+		addCallgraphStats(sysvals, hf, testruns)
 
 	# add the test log as a hidden div
 	if sysvals.testlog and sysvals.logmsg:
 		hf.write('<div id="testlog" style="display:none;">\n'+sysvals.logmsg+'</div>\n')
 	# add the dmesg log as a hidden div
 	if sysvals.dmesglog and sysvals.dmesgfile:
-		hf.write('<div id="dmesglog" style="display:none;">\n')
-		lf = sysvals.openlog(sysvals.dmesgfile, 'r')
-		for line in lf:
-			line = line.replace('<', '&lt').replace('>', '&gt')
-			hf.write(line)
-		lf.close()
-		hf.write('</div>\n')
+		addLogHTML(sysvals, hf, 'dmesglog', sysvals.dmesgfile)
 	# add the ftrace log as a hidden div
 	if sysvals.ftracelog and sysvals.ftracefile:
-		hf.write('<div id="ftracelog" style="display:none;">\n')
-		lf = sysvals.openlog(sysvals.ftracefile, 'r')
-		for line in lf:
-			hf.write(line)
-		lf.close()
-		hf.write('</div>\n')
+		addLogHTML(sysvals, hf, 'ftracelog', sysvals.ftracefile)
 
 	# write the footer and close
 	addScriptCode(hf, testruns)
@@ -4022,6 +4908,9 @@ def addCSS(hf, sv, testcount=1, kerror=False, extra=''):
 		.stamp.sysinfo {font:10px Arial;}\n\
 		.callgraph {margin-top:30px;box-shadow:5px 5px 20px black;}\n\
 		.callgraph article * {padding-left:28px;}\n\
+		table.cgstat {width:auto;font:13px Arial;border-collapse:collapse;}\n\
+		.cgstat th, .cgstat td {padding:0 10px;text-align:right;border-bottom:1px solid #ccc;}\n\
+		.cgstat td:first-child {text-align:left;}\n\
 		h1 {color:black;font:bold 30px Times;}\n\
 		t0 {color:black;font:bold 30px Times;}\n\
 		t1 {color:black;font:30px Times;}\n\
@@ -4309,6 +5198,7 @@ def addScriptCode(hf, testruns):
 	'			cgid = cg[i].id.split("x")[0]\n'\
 	'			if(idlist.indexOf(cgid) >= 0) {\n'\
 	'				cg[i].style.display = "block";\n'\
+	'				cgInflate(cg[i]);\n'\
 	'			} else {\n'\
 	'				cg[i].style.display = "none";\n'\
 	'			}\n'\
@@ -4367,6 +5257,31 @@ def addScriptCode(hf, testruns):
 	'		dd.style.height = height+"px";\n'\
 	'		document.getElementById("devicedetail").style.height = height+"px";\n'\
 	'	}\n'\
+	'	function inflate(b64, fmt) {\n'\
+	'		var bin = atob(b64);\n'\
+	'		var buf = new Uint8Array(bin.length);\n'\
+	'		for(var i = 0; i < bin.length; i++)\n'\
+	'			buf[i] = bin.charCodeAt(i);\n'\
+	'		var ds = new Response(buf).body.pipeThrough(new DecompressionStream(fmt));\n'\
+	'		return new Response(ds).text();\n'\
+	'	}\n'\
+	'	function cgInflate(cg) {\n'\
+	'		var z = cg.getElementsByClassName("cgz");\n'\
+	'		if(z.length < 1) return;\n'\
+	'		var blob = z[0];\n'\
+	'		blob.className = "hide";\n'\
+	'		inflate(blob.textContent, "deflate").then(function(html) {blob.outerHTML = html;});\n'\
+	'	}\n'\
+	'	function getLog(name, func) {\n'\
+	'		var log = document.getElementById(name);\n'\
+	'		if(log.className != "logz")\n'\
+	'			func(log.innerHTML);\n'\
+	'		else\n'\
+	'			inflate(log.textContent, "gzip").then(func);\n'\
+	'	}\n'\
+	'	function cgToggle() {\n'\
+	'		cgInflate(this.parentNode);\n'\
+	'	}\n'\
 	'	function callSelect() {\n'\
 	'		var cglist = document.getElementById("callgraphs");\n'\
 	'		if(!cglist) return;\n'\
@@ -4374,6 +5289,7 @@ def addScriptCode(hf, testruns):
 	'		for (var i = 0; i < cg.length; i++) {\n'\
 	'			if(this.id == cg[i].id) {\n'\
 	'				cg[i].style.display = "block";\n'\
+	'				cgInflate(cg[i]);\n'\
 	'			} else {\n'\
 	'				cg[i].style.display = "none";\n'\
 	'			}\n'\
@@ -4395,30 +5311,32 @@ def addScriptCode(hf, testruns):
 	'		var idx1 = parseInt(range[0]);\n'\
 	'		var idx2 = parseInt(range[1]);\n'\
 	'		var win = window.open();\n'\
-	'		var log = document.getElementById("dmesglog");\n'\
 	'		var title = "<title>dmesg log</title>";\n'\
-	'		var text = log.innerHTML.split("\\n");\n'\
-	'		var html = "";\n'\
-	'		for(var i = 0; i < text.length; i++) {\n'\
-	'			if(i == idx1) {\n'\
-	'				html += "<e id=target>"+text[i]+"</e>\\n";\n'\
-	'			} else if(i > idx1 && i <= idx2) {\n'\
-	'				html += "<e>"+text[i]+"</e>\\n";\n'\
-	'			} else {\n'\
-	'				html += text[i]+"\\n";\n'\
+	'		getLog("dmesglog", function(log) {\n'\
+	'			var text = log.split("\\n");\n'\
+	'			var html = "";\n'\
+	'			for(var i = 0; i < text.length; i++) {\n'\
+	'				if(i == idx1) {\n'\
+	'					html += "<e id=target>"+text[i]+"</e>\\n";\n'\
+	'				} else if(i > idx1 && i <= idx2) {\n'\
+	'					html += "<e>"+text[i]+"</e>\\n";\n'\
+	'				} else {\n'\
+	'					html += text[i]+"\\n";\n'\
+	'				}\n'\
 	'			}\n'\
-	'		}\n'\
-	'		win.document.write("<style>e{color:red}</style>"+title+"<pre>"+html+"</pre>");\n'\
-	'		win.location.hash = "#target";\n'\
-	'		win.document.close();\n'\
+	'			win.document.write("<style>e{color:red}</style>"+title+"<pre>"+html+"</pre>");\n'\
+	'			win.location.hash = "#target";\n'\
+	'			win.document.close();\n'\
+	'		});\n'\
 	'	}\n'\
 	'	function logWindow(e) {\n'\
 	'		var name = e.target.id.slice(4);\n'\
 	'		var win = window.open();\n'\
-	'		var log = document.getElementById(name+"log");\n'\
 	'		var title = "<title>"+document.title.split(" ")[0]+" "+name+" log</title>";\n'\
-	'		win.document.write(title+"<pre>"+log.innerHTML+"</pre>");\n'\
-	'		win.document.close();\n'\
+	'		getLog(name+"log", function(log) {\n'\
+	'			win.document.write(title+"<pre>"+log+"</pre>");\n'\
+	'			win.document.close();\n'\
+	'		});\n'\
 	'	}\n'\
 	'	function onMouseDown(e) {\n'\
 	'		dragval[0] = e.clientX;\n'\
@@ -4472,6 +5390,9 @@ def addScriptCode(hf, testruns):
 	'		var dev = dmesg.getElementsByClassName("srccall");\n'\
 	'		for (var i = 0; i < dev.length; i++)\n'\
 	'			dev[i].onclick = callSelect;\n'\
+	'		var cgz = document.getElementsByClassName("cgz");\n'\
+	'		for (var i = 0; i < cgz.length; i++)\n'\
+	'			cgz[i].parentNode.getElementsByClassName("pf")[0].onchange = cgToggle;\n'\
 	'		zoomTimeline();\n'\
 	'	});\n'\
 	'</script>\n'
@@ -5282,10 +6203,19 @@ def processData(live=False):
 		for data in testruns:
 			data.debugPrint()
 		sys.exit(0)
+	if sysvals.usecallgraph:
+		for data in testruns:
+			data.optimizeCallgraphs()
+			if sysvals.cgstats:
+				data.cgstats = data.callgraphStats()
 	if len(testruns) < 1:
 		return (testruns, {'error': 'timeline generation failed'})
 	sysvals.vprint('Creating the html timeline (%s)...' % sysvals.htmlfile)
 	createHTML(testruns, error)
+	if sysvals.usecallgraph and sysvals.flamegraph:
+		createFlameGraphFiles(sysvals, testruns)
+	if sysvals.usecallgraph and sysvals.cgstats:
+		createCallgraphStatsFile(sysvals, testruns)
 	print('DONE')
 	data = testruns[0]
 	stamp = data.stamp
@@ -5294,6 +6224,9 @@ def processData(live=False):
 		stamp['fwsuspend'], stamp['fwresume'] = data.fwSuspend, data.fwResume
 	if error:
 		stamp['error'] = error
+	createResultJSON(sysvals, testruns, stamp)
+	if sysvals.devdb:
+		devdbInsert(sysvals, testruns, stamp)
 	return (testruns, stamp)
 
 # Function: rerunTest
@@ -5328,6 +6261,10 @@ def runTest(n=0):
 	if sysvals.skiphtml:
 		sysvals.sudouser(sysvals.testdir)
 		return
+	if sysvals.multitest['run'] and sysvals.multitest['batch']:
+		# capture only, the logs are analysed in a batch
+		sysvals.sudouser(sysvals.testdir)
+		return 0
 	testruns, stamp = processData(True)
 	for data in testruns:
 		del data
@@ -5337,25 +6274,30 @@ def runTest(n=0):
 		return 2
 	return 0
 
+# timeline device divs, one per line: title and extra classes
+htmlthreadfmt = re.compile('^ *<div id=\"[a,0-9]*\" *title=\"(?P<title>.*)\" class=\"thread(?P<cls>[^\"]*)', re.M)
+
 def find_in_html(html, start, end, firstonly=True):
+	# search from an offset instead of slicing so the scan stays linear
+	rstart, rend = re.compile(start), re.compile(end)
 	n, out = 0, []
 	while n < len(html):
-		m = re.search(start, html[n:])
+		m = rstart.search(html, n)
 		if not m:
 			break
 		i = m.end()
-		m = re.search(end, html[n+i:])
+		m = rend.search(html, i)
 		if not m:
 			break
 		j = m.start()
-		str = html[n+i:n+i+j]
+		str = html[i:j]
 		if end == 'ms':
 			num = re.search(r'[-+]?\d*\.\d+|\d+', str)
 			str = num.group() if num else 'NaN'
 		if firstonly:
 			return str
 		out.append(str)
-		n += i+j
+		n = j
 	if firstonly:
 		return ''
 	return out
@@ -5375,14 +6317,14 @@ def data_from_html(file, outpath, devlist=False):
 	tstr = dt.strftime('%Y/%m/%d %H:%M:%S')
 	error = find_in_html(html, '<table class="testfail"><tr><td>', '</td>')
 	result = 'fail' if error else 'pass'
-	ilist = []
-	e = find_in_html(html, 'class="err"[\w=":;\.%\- ]*>', '&rarr;</div>', False)
-	for i in list(set(e)):
-		ilist.append('%sx%d' % (i, e.count(i)) if e.count(i) > 1 else i)
+	ilist, ecnt = [], dict()
+	for i in find_in_html(html, 'class="err"[\w=":;\.%\- ]*>', '&rarr;</div>', False):
+		ecnt[i] = ecnt[i] + 1 if i in ecnt else 1
+	for i in ecnt:
+		ilist.append('%sx%d' % (i, ecnt[i]) if ecnt[i] > 1 else i)
 	devices = dict()
-	for line in html.split('\n'):
-		m = re.match(' *<div id=\"[a,0-9]*\" *title=\"(?P<title>.*)\" class=\"thread.*', line)
-		if not m or 'thread kth' in line or 'thread sec' in line:
+	for m in htmlthreadfmt.finditer(html):
+		if m.group('cls').startswith(' kth') or m.group('cls').startswith(' sec'):
 			continue
 		m = re.match('(?P<n>.*) \((?P<t>[0-9,\.]*) ms\) (?P<p>.*)', m.group('title'))
 		if not m:
@@ -5412,15 +6354,62 @@ def data_from_html(file, outpath, devlist=False):
 		data['devlist'] = devices
 	return data
 
-# Function: runSummary
+# Function: data_from_json
 # Description:
-#	 create a summary of tests in a sub-directory
-def runSummary(subdir, local=True, genhtml=False):
-	inpath = os.path.abspath(subdir)
-	outpath = os.path.abspath('.') if local else inpath
-	print('Generating a summary of folder "%s"' % inpath)
-	if genhtml:
-		for dirname, dirnames, filenames in os.walk(subdir):
+#	 Read the summary data for an html file from its *_result.json sidecar
+#	 written by createResultJSON. Returns False if there isn't one.
+def data_from_json(file, outpath, devlist=False):
+	jsonfile = file[:-5]+'_result.json'
+	if not file.endswith('.html') or not os.path.exists(jsonfile):
+		return False
+	try:
+		fp = open(jsonfile, 'r')
+		res = json.load(fp)
+		fp.close()
+	except:
+		return False
+	res = jsonStrings(res)
+	data = dict()
+	for key in ['mode', 'host', 'kernel', 'time', 'result', 'issues',
+		'suspend', 'resume', 'worst', 'worsttime']:
+		if key not in res:
+			return False
+		data[key] = res[key]
+	data['url'] = os.path.relpath(file, outpath)
+	if devlist:
+		data['devlist'] = res['devices']
+	return data
+
+# Function: jsonStrings
+# Description:
+#	 Convert the unicode strings from json.load back into utf-8 strings
+def jsonStrings(val):
+	if isinstance(val, unicode):
+		return val.encode('utf-8')
+	elif isinstance(val, list):
+		return [jsonStrings(i) for i in val]
+	elif isinstance(val, dict):
+		out = dict()
+		for k in val:
+			out[jsonStrings(k)] = jsonStrings(val[k])
+		return out
+	return val
+
+# Function: summaryFolder
+# Description:
+#	 Process one test folder for runSummary: regenerate a missing html
+#	 timeline if asked to, then extract the summary data of each html.
+#	 Runs in its own process when the summary is parallel, so the global
+#	 sysvals changes made by rerunTest stay isolated to this folder.
+# Arguments:
+#	 args: (dirname, filenames, outpath, genhtml)
+# Output:
+#	 array of summary data dicts from data_from_json/data_from_html, or
+#	 None if the folder failed and should be retried on the next run
+def summaryFolder(args):
+	dirname, filenames, outpath, genhtml = args
+	try:
+		if genhtml:
 			sysvals.dmesgfile = sysvals.ftracefile = sysvals.htmlfile = ''
 			for filename in filenames:
 				if(re.match('.*_dmesg.txt', filename)):
@@ -5434,19 +6423,251 @@ def runSummary(subdir, local=True, genhtml=False):
 				if sysvals.dmesgfile:
 					print('DMESG : %s' % sysvals.dmesgfile)
 				rerunTest()
-	testruns = []
-	for dirname, dirnames, filenames in os.walk(subdir):
-		for filename in filenames:
+				filenames = os.listdir(dirname)
+		out = []
+		for filename in sorted(filenames):
 			if(not re.match('.*.html', filename)):
 				continue
-			data = data_from_html(os.path.join(dirname, filename), outpath)
+			file = os.path.join(dirname, filename)
+			data = data_from_json(file, outpath)
+			if not data:
+				data = data_from_html(file, outpath)
 			if(not data):
 				continue
-			testruns.append(data)
+			out.append(data)
+		return out
+	except:
+		print('WARNING: failed to summarize %s, skipping it' % dirname)
+		return None
+
+# Function: summaryIndex
+# Description:
+#	 Load the incremental summary index (summary.jsonl) from the output dir.
+#	 Each line is a processed test folder: {"dir", "mtime", "tests"}, and
+#	 later lines for the same folder replace earlier ones.
+# Output:
+#	 (dict of {dir: entry}, total number of lines in the file)
+def summaryIndex(file):
+	index, lines = dict(), 0
+	if not os.path.exists(file):
+		return (index, lines)
+	fp = open(file, 'r')
+	for line in fp:
+		lines += 1
+		try:
+			entry = jsonStrings(json.loads(line))
+			index[entry['dir']] = entry
+		except:
+			continue
+	fp.close()
+	return (index, lines)
+
+# Function: summaryFolderTime
+# Description:
+#	 Get the latest modification time of a folder and its files, or -1 if
+#	 -genhtml would create a missing html timeline for it
+def summaryFolderTime(dirname, filenames, genhtml):
+	mtime = os.path.getmtime(dirname)
+	for filename in filenames:
+		if filename in ['summary.html', 'summary.jsonl']:
+			continue
+		file = os.path.join(dirname, filename)
+		if genhtml:
+			m = re.match('(?P<name>.*)_ftrace\.txt.*', file)
+			if m and not os.path.exists(m.group('name')+'.html'):
+				return -1
+		try:
+			mtime = max(mtime, os.path.getmtime(file))
+		except:
+			continue
+	return mtime
+
+# Function: runSummary
+# Description:
+#	 create a summary of tests in a sub-directory. The folders are processed
+#	 by a pool of sysvals.jobs processes (default: one per cpu), each folder
+#	 in a fresh process, and merged back in sorted folder order. Results are
+#	 kept in summary.jsonl in the output dir so a rerun only processes the
+#	 folders that are new or have changed since.
+def runSummary(subdir, local=True, genhtml=False):
+	inpath = os.path.abspath(subdir)
+	outpath = os.path.abspath('.') if local else inpath
+	print('Generating a summary of folder "%s"' % inpath)
+	indexfile = os.path.join(outpath, 'summary.jsonl')
+	index, lines = summaryIndex(indexfile)
+	dirs, tasks = [], []
+	for dirname, dirnames, filenames in os.walk(inpath):
+		dirnames.sort()
+		dirs.append(dirname)
+		mtime = summaryFolderTime(dirname, filenames, genhtml)
+		if mtime >= 0 and dirname in index and index[dirname]['mtime'] == mtime:
+			continue
+		tasks.append((dirname, filenames, outpath, genhtml))
+	sysvals.vprint('%d folders, %d new or changed' % (len(dirs), len(tasks)))
+	jobs = sysvals.jobs if sysvals.jobs > 0 else cpu_count()
+	jobs = min(jobs, len(tasks))
+	if jobs > 1:
+		pool = Pool(jobs, maxtasksperchild=1)
+		results = pool.map(summaryFolder, tasks, 1)
+		pool.close()
+		pool.join()
+	else:
+		results = map(summaryFolder, tasks)
+	# drop folders under inpath which are gone, add the new results
+	for dirname in index.keys():
+		if (dirname == inpath or dirname.startswith(inpath+os.sep)) and \
+			dirname not in dirs:
+			del index[dirname]
+	new = []
+	for i in range(len(tasks)):
+		# a failed folder isn't indexed, so the next run retries it
+		if results[i] is None:
+			continue
+		dirname = tasks[i][0]
+		filenames = [f for f in os.listdir(dirname) \
+			if os.path.isfile(os.path.join(dirname, f))]
+		entry = {'dir': dirname, 'tests': results[i],
+			'mtime': summaryFolderTime(dirname, filenames, False)}
+		index[dirname] = entry
+		new.append(entry)
+	# append to the index, or rewrite it once it's mostly stale lines
+	if lines + len(new) > 2 * len(index):
+		fp, new = open(indexfile, 'w'), [index[d] for d in sorted(index)]
+	else:
+		fp = open(indexfile, 'a')
+	for entry in new:
+		fp.write(json.dumps(entry, sort_keys=True)+'\n')
+	fp.close()
+	testruns = []
+	for dirname in dirs:
+		if dirname in index:
+			testruns += index[dirname]['tests']
 	outfile = os.path.join(outpath, 'summary.html')
 	print('Summary file: %s' % outfile)
 	createHTMLSummarySimple(testruns, outfile, inpath)
 
+# Function: daemonAnalyse
+# Description:
+#	 Build the missing timelines and the summary of a daemon output folder
+#	 at the lowest cpu priority, run in a child process of the daemon.
+def daemonAnalyse(outdir):
+	os.nice(19)
+	if sysvals.jobs < 1:
+		sysvals.jobs = 1
+	runSummary(outdir, False, True)
+
+# Function: runDaemon
+# Description:
+#	 Watch for suspend/resumes started by anyone else and capture them.
+#	 Only the suspend_resume and device_pm_callback trace events are on,
+#	 with a small trace buffer, and trace_pipe is read as a stream. A cycle
+#	 runs from suspend_enter begin to thaw_processes end, each one is saved
+#	 as an ftrace log in its own test folder, and every sysvals.daemonbatch
+#	 captures are analysed in a background process. Runs until interrupted.
+# Arguments:
+#	 outdir: the folder to put the captures and the summary in
+def runDaemon(outdir):
+	sysvals.rootCheck(True)
+	if not os.path.isdir(outdir):
+		os.mkdir(outdir)
+	sysvals.systemInfo(dmidecode(sysvals.mempath))
+	sysvals.usetraceevents = True
+	sysvals.usecallgraph = sysvals.usedevsrc = sysvals.usekprobes = False
+	tp = sysvals.tpath
+	for e in sysvals.traceevents:
+		if not os.path.exists(tp+'events/power/'+e):
+			doError('the %s trace event is missing from this kernel' % e)
+	# trace setup: just the pm events in a small buffer
+	sysvals.fsetVal('0', 'tracing_on')
+	sysvals.cleanupFtrace()
+	sysvals.fsetVal('global', 'trace_clock')
+	sysvals.fsetVal('nop', 'current_tracer')
+	bufsize = sysvals.bufsize if sysvals.bufsize > 0 else 1024
+	sysvals.fsetVal('%d' % max(bufsize / max(1, sysvals.cpucount), 64), 'buffer_size_kb')
+	for e in sysvals.traceevents:
+		sysvals.fsetVal('1', 'events/power/'+e+'/enable')
+	sysvals.fsetVal('', 'trace')
+	sysvals.fsetVal('1', 'tracing_on')
+	modes = ['on', 'freeze', 'standby', 'mem', 'disk']
+	startfmt = re.compile('.* suspend_resume: suspend_enter\[(?P<m>[0-9]*)\] begin')
+	endfmt = re.compile('.* suspend_resume: thaw_processes\[[0-9]*\] end')
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	print('Watching for suspend/resume in "%s", press ctrl-c to stop' % outdir)
+	tstart, cstart = time.time(), os.times()
+	cycle, when, mode = None, None, ''
+	captures, queued, lines, peak = 0, 0, 0, 0
+	worker = None
+	fp = open(tp+'trace_pipe', 'r')
+	try:
+		# readline, a file iterator would wait for a full read-ahead buffer
+		for line in iter(fp.readline, ''):
+			lines += 1
+			if cycle is None:
+				m = startfmt.match(line)
+				if m:
+					cycle, when = [line], datetime.now()
+					mode = modes[int(m.group('m'))] if m.group('m') in ['1', '2', '3', '4'] else 'mem'
+				continue
+			cycle.append(line)
+			if len(cycle) > sysvals.daemonmaxlines:
+				print('WARNING: suspend/resume exceeds %d trace lines, dropping it '\
+					'(see -daemonlines)' % sysvals.daemonmaxlines)
+				cycle = None
+				continue
+			if not endfmt.match(line):
+				continue
+			# a whole cycle, save it as a capture-only test
+			peak = max(peak, len(cycle))
+			sysvals.suspendmode = mode
+			sysvals.testdir = os.path.join(outdir, when.strftime('suspend-%y%m%d-%H%M%S'))
+			if os.path.exists(sysvals.testdir):
+				sysvals.testdir += '-%d' % captures
+			sysvals.initTestOutput('suspend')
+			sysvals.teststamp = '# %s %s %s %s' % (when.strftime('suspend-%m%d%y-%H%M%S'),
+				sysvals.hostname, mode, platform.release())
+			fw = getFPDT(False) if mode == 'mem' else False
+			# write it under a temp name so a running analysis skips it
+			tmpfile = os.path.join(sysvals.testdir, '.capture')
+			op = sysvals.writeDatafileHeader(tmpfile, [fw], [])
+			op.write('# tracer: nop\n')
+			for l in cycle:
+				op.write(l)
+			op.close()
+			os.rename(tmpfile, sysvals.ftracefile)
+			sysvals.sudouser(sysvals.testdir)
+			cycle = None
+			captures += 1
+			queued += 1
+			cpu = os.times()
+			sysvals.vprint('CAPTURED %s (%d lines), daemon cpu %.2fs in %.0fs, maxrss %d kB' % \
+				(sysvals.testdir, peak, cpu[0]+cpu[1]-cstart[0]-cstart[1],
+				time.time()-tstart, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+			# hand a batch of captures to a low priority analysis process
+			if queued >= sysvals.daemonbatch and (not worker or not worker.is_alive()):
+				worker = Process(target=daemonAnalyse, args=(outdir,))
+				worker.start()
+				queued = 0
+	except (KeyboardInterrupt, SystemExit, IOError):
+		pass
+	fp.close()
+	sysvals.fsetVal('0', 'tracing_on')
+	for e in sysvals.traceevents:
+		sysvals.fsetVal('0', 'events/power/'+e+'/enable')
+	sysvals.cleanupFtrace()
+	cpu = os.times()
+	elapsed = time.time() - tstart
+	used = cpu[0] + cpu[1] - cstart[0] - cstart[1]
+	print('Daemon stats: %d captures, %d trace lines, peak capture %d lines' % \
+		(captures, lines, peak))
+	print('  cpu %.2fs in %.0fs (%.4f%%), maxrss %d kB' % (used, elapsed,
+		100.0 * used / elapsed if elapsed > 0 else 0,
+		resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+	if worker:
+		worker.join()
+	if captures > 0:
+		runSummary(outdir, False, True)
+	sysvals.sudouser(outdir)
+
 # Function: checkArgBool
 # Description:
 #	 check if a boolean string value is true or false
@@ -5476,6 +6697,8 @@ def configFromFile(file):
 				sysvals.verbose = checkArgBool(option, value)
 			elif(option == 'addlogs'):
 				sysvals.dmesglog = sysvals.ftracelog = checkArgBool(option, value)
+			elif(option == 'ziplogs'):
+				sysvals.ziplogs = checkArgBool(option, value)
 			elif(option == 'dev'):
 				sysvals.usedevsrc = checkArgBool(option, value)
 			elif(option == 'proc'):
@@ -5491,6 +6714,12 @@ def configFromFile(file):
 				overridedevkprobes = checkArgBool(option, value)
 			elif(option == 'skiphtml'):
 				sysvals.skiphtml = checkArgBool(option, value)
+			elif(option == 'batch'):
+				if checkArgBool(option, value):
+					sysvals.multitest['batch'] = 'end'
+			elif(option == 'batchbg'):
+				if checkArgBool(option, value):
+					sysvals.multitest['batch'] = 'bg'
 			elif(option == 'sync'):
 				sysvals.sync = checkArgBool(option, value)
 			elif(option == 'rs' or option == 'runtimesuspend'):
@@ -5546,6 +6775,18 @@ def configFromFile(file):
 				sysvals.setDeviceFilter(value)
 			elif(option == 'expandcg'):
 				sysvals.cgexp = checkArgBool(option, value)
+			elif(option == 'lazycg'):
+				sysvals.cglazy = checkArgBool(option, value)
+			elif(option == 'flamegraph'):
+				sysvals.flamegraph = checkArgBool(option, value)
+			elif(option == 'cgstats'):
+				sysvals.cgstats = getArgInt('cgstats', value, 0, 10000, False)
+			elif(option == 'daemonbatch'):
+				sysvals.daemonbatch = getArgInt('daemonbatch', value, 1, 10000, False)
+			elif(option == 'daemonmaxlines'):
+				sysvals.daemonmaxlines = getArgInt('daemonmaxlines', value, 1000, 1000000000, False)
+			elif(option == 'devdb'):
+				sysvals.devdb = os.path.abspath(value)
 			elif(option == 'srgap'):
 				if checkArgBool(option, value):
 					sysvals.srgap = 5
@@ -5574,7 +6815,7 @@ def configFromFile(file):
 			elif(option == 'callloop-maxgap'):
 				sysvals.callloopmaxgap = getArgFloat('callloop-maxgap', value, 0.0, 1.0, False)
 			elif(option == 'callloop-maxlen'):
-				sysvals.callloopmaxgap = getArgFloat('callloop-maxlen', value, 0.0, 1.0, False)
+				sysvals.callloopmaxlen = getArgFloat('callloop-maxlen', value, 0.0, 1.0, False)
 			elif(option == 'mincg'):
 				sysvals.mincglen = getArgFloat('mincg', value, 0.0, 10000.0, False)
 			elif(option == 'bufsize'):
@@ -5683,6 +6924,7 @@ def printHelp():
 	print('   HTML output:                    <hostname>_<mode>.html')
 	print('   raw dmesg output:               <hostname>_<mode>_dmesg.txt')
 	print('   raw ftrace output:              <hostname>_<mode>_ftrace.txt')
+	print('   result summary:                 <hostname>_<mode>_result.json')
 	print('')
 	print('Options:')
 	print('   -h           Print this help text')
@@ -5694,9 +6936,11 @@ def printHelp():
 	print('                default: suspend-{date}-{time}')
 	print('   -rtcwake t   Wakeup t seconds after suspend, set t to "off" to disable (default: 15)')
 	print('   -addlogs     Add the dmesg and ftrace logs to the html output')
+	print('   -ziplogs     Store the -addlogs logs in the html as compressed blobs')
 	print('   -srgap       Add a visible gap in the timeline between sus/res (default: disabled)')
 	print('   -skiphtml    Run the test and capture the trace logs, but skip the timeline (default: disabled)')
 	print('   -result fn   Export a results table to a text file for parsing.')
+	print('   -devdb fn    Add the device callback times to an sqlite database for regressions')
 	print('  [testprep]')
 	print('   -sync        Sync the filesystems before starting the test')
 	print('   -rs on/off   Enable/disable runtime suspend for all devices, restore all after test')
@@ -5713,10 +6957,19 @@ def printHelp():
 	print('   -mindev ms   Discard all device blocks shorter than ms milliseconds (e.g. 0.001 for us)')
 	print('   -multi n d   Execute <n> consecutive tests at <d> seconds intervals. The outputs will')
 	print('                be created in a new subdirectory with a summary page.')
+	print('   -batch       With -multi, only capture during the tests and build every timeline')
+	print('                at the end in parallel (-jobs N, default: cpu count)')
+	print('   -batchbg     With -multi, only capture during the tests and build the timelines')
+	print('                in a lowest priority background pool (-jobs N, default: 1)')
+	print('                -batch and -batchbg are not compatible with -result')
 	print('  [debug]')
 	print('   -f           Use ftrace to create device callgraphs (default: disabled)')
 	print('   -maxdepth N  limit the callgraph data to N call levels (default: 0=all)')
 	print('   -expandcg    pre-expand the callgraph data in the html output (default: disabled)')
+	print('   -lazycg      compress each callgraph and expand it on demand in the html (default: disabled)')
+	print('   -flamegraph  export the callgraphs as folded stacks and per function self time')
+	print('   -cgstats N   show the top N functions by self time per test/phase/device, and export')
+	print('                total/self time and calls of every function to a csv (default: disabled)')
 	print('   -fadd file   Add functions to be graphed in the timeline from a list in a text file')
 	print('   -filter "d1,d2,..." Filter out all but this comma-delimited list of device names')
 	print('   -mincg  ms   Discard all callgraphs shorter than ms milliseconds (e.g. 0.001 for us)')
@@ -5737,6 +6990,12 @@ def printHelp():
 	print('   -flist       Print the list of functions currently being captured in ftrace')
 	print('   -flistall    Print all functions capable of being captured in ftrace')
 	print('   -summary dir Create a summary of tests in this dir [-genhtml builds missing html]')
+	print('                -jobs N sets the number of parallel processes (default: cpu count)')
+	print('   -daemon dir  Capture every suspend/resume started on this system into dir and')
+	print('                build the timelines in the background (ctrl-c to stop)')
+	print('                -daemonlines N drops cycles longer than N trace lines (default: 500000)')
+	print('   -devreport fn  Report the devices whose p50/p95 times moved the most between')
+	print('                the last two kernels of each host/mode in device database fn')
 	print('  [redo]')
 	print('   -ftrace ftracefile  Create HTML output using ftrace input (used with -dmesg)')
 	print('   -dmesg dmesgfile    Create HTML output using dmesg (used with -ftrace)')
@@ -5782,12 +7041,26 @@ if __name__ == '__main__':
 			sysvals.usecallgraph = True
 		elif(arg == '-skiphtml'):
 			sysvals.skiphtml = True
+		elif(arg == '-batch'):
+			sysvals.multitest['batch'] = 'end'
+		elif(arg == '-batchbg'):
+			sysvals.multitest['batch'] = 'bg'
 		elif(arg == '-cgdump'):
 			sysvals.cgdump = True
 		elif(arg == '-genhtml'):
 			genhtml = True
+		elif(arg == '-jobs'):
+			sysvals.jobs = getArgInt('-jobs', args, 1, 1024)
+		elif(arg == '-devdb'):
+			try:
+				val = args.next()
+			except:
+				doError('No database file supplied', True)
+			sysvals.devdb = os.path.abspath(val)
 		elif(arg == '-addlogs'):
 			sysvals.dmesglog = sysvals.ftracelog = True
+		elif(arg == '-ziplogs'):
+			sysvals.ziplogs = True
 		elif(arg == '-verbose'):
 			sysvals.verbose = True
 		elif(arg == '-proc'):
@@ -5884,6 +7157,12 @@ if __name__ == '__main__':
 			sysvals.suspendmode = 'command'
 		elif(arg == '-expandcg'):
 			sysvals.cgexp = True
+		elif(arg == '-lazycg'):
+			sysvals.cglazy = True
+		elif(arg == '-flamegraph'):
+			sysvals.flamegraph = True
+		elif(arg == '-cgstats'):
+			sysvals.cgstats = getArgInt('-cgstats', args, 1, 10000)
 		elif(arg == '-srgap'):
 			sysvals.srgap = 5
 		elif(arg == '-multi'):
@@ -5942,6 +7221,25 @@ if __name__ == '__main__':
 			sysvals.notestrun = True
 			if(os.path.isdir(val) == False):
 				doError('%s is not accesible' % val)
+		elif(arg == '-daemon'):
+			try:
+				val = args.next()
+			except:
+				doError('No directory supplied', True)
+			cmd = 'daemon'
+			sysvals.outdir = val
+		elif(arg == '-daemonlines'):
+			sysvals.daemonmaxlines = getArgInt('-daemonlines', args, 1000, 1000000000)
+		elif(arg == '-devreport'):
+			try:
+				val = args.next()
+			except:
+				doError('No database file supplied', True)
+			cmd = 'devreport'
+			sysvals.devdb = val
+			sysvals.notestrun = True
+			if(os.path.isfile(val) == False):
+				doError('%s does not exist' % val)
 		elif(arg == '-filter'):
 			try:
 				val = args.next()
@@ -5962,6 +7260,9 @@ if __name__ == '__main__':
 		doError('-dev is not compatible with -f')
 	if(sysvals.usecallgraph and sysvals.useprocmon):
 		doError('-proc is not compatible with -f')
+	if(sysvals.result and sysvals.multitest['run'] and \
+		sysvals.multitest['batch'] and not sysvals.skiphtml):
+		doError('-result is not compatible with -batch or -batchbg')
 
 	if sysvals.usecallgraph and sysvals.cgskip:
 		sysvals.vprint('Using cgskip file: %s' % sysvals.cgskip)
@@ -6004,6 +7305,10 @@ if __name__ == '__main__':
 			sysvals.getFtraceFilterFunctions(False)
 		elif(cmd == 'summary'):
 			runSummary(sysvals.outdir, True, genhtml)
+		elif(cmd == 'daemon'):
+			runDaemon(sysvals.outdir)
+		elif(cmd == 'devreport'):
+			devdbReport(sysvals.devdb, os.path.abspath('devreport.html'))
 		sys.exit(ret)
 
 	# if instructed, re-analyze existing data files
@@ -6046,6 +7351,12 @@ if __name__ == '__main__':
 			sysvals.outdir = datetime.now().strftime(s+'-%y%m%d-%H%M%S')
 		if not os.path.isdir(sysvals.outdir):
 			os.mkdir(sysvals.outdir)
+		batch = sysvals.multitest['batch'] if not sysvals.skiphtml else ''
+		if batch == 'bg':
+			# analyse each capture in a lowest priority worker while the
+			# next tests run, one worker unless -jobs says otherwise
+			jobs = sysvals.jobs if sysvals.jobs > 0 else 1
+			pool = Pool(jobs, os.nice, (19,), maxtasksperchild=1)
 		for i in range(sysvals.multitest['count']):
 			if(i != 0):
 				print('Waiting %d seconds...' % (sysvals.multitest['delay']))
@@ -6056,8 +7367,16 @@ if __name__ == '__main__':
 			ret = runTest(i+1)
 			print('TEST (%d/%d) COMPLETE' % (i+1, sysvals.multitest['count']))
 			sysvals.logmsg = ''
+			if batch == 'bg':
+				pool.apply_async(summaryFolder, ((sysvals.testdir,
+					os.listdir(sysvals.testdir), sysvals.outdir, True),))
+		if batch == 'bg':
+			print('Waiting for the background analysis to finish...')
+			pool.close()
+			pool.join()
 		if not sysvals.skiphtml:
-			runSummary(sysvals.outdir, False, False)
+			# in batch mode the summary builds any timelines still missing
+			runSummary(sysvals.outdir, False, batch != '')
 		sysvals.sudouser(sysvals.outdir)
 	else:
 		if sysvals.outdir:
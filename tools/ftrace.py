@@ -31,98 +31,200 @@ import datetime
 import struct
 import analyze_suspend as aslib
 
-# Function: analyzeTraceLog
+sysvals = aslib.sysvals
+sysvals.cglazy = True
+sysvals.setPrecision(6)
+maxlines = 100000
+pidfilter = -1
+funcfilter = ''
+
+# Class: CallgraphSummary
 # Description:
-#	 Analyse an ftrace log output file generated from this app during
-#	 the execution phase. Create an "ftrace" structure in memory for
-#	 subsequent formatting in the html output file
-def analyzeTraceLog(file):
-	global sysvals
+#	 The number of calls and the total and max time of each top level
+#	 function per process, with the html id of its longest written call.
+#	 Its size depends on the number of process/function pairs only.
+class CallgraphSummary:
+	def __init__(self):
+		self.funcs = dict()
+		self.written = 0
+		self.dropped = 0
+	def add(self, proc, pid, cg, cgid):
+		key = (proc, pid, cg.name)
+		if key not in self.funcs:
+			self.funcs[key] = {'calls': 0, 'total': 0.0, 'max': 0.0, 'id': ''}
+		f = self.funcs[key]
+		length = cg.end - cg.start
+		f['calls'] += 1
+		f['total'] += length
+		if length >= f['max']:
+			f['max'] = length
+			f['id'] = cgid
+		if cgid:
+			self.written += 1
+	def html(self, hf):
+		hf.write('<table class="summary">\n<tr><th>Process</th><th>Function</th>'\
+			'<th>Calls</th><th>Total(ms)</th><th>Avg(ms)</th><th>Max(ms)</th></tr>\n')
+		list = sorted(self.funcs.items(), key=lambda i:i[1]['total'], reverse=True)
+		for key, f in list:
+			proc, pid, name = key
+			if f['id']:
+				name = '<a href="#%s">%s</a>' % (f['id'], name)
+			hf.write('<tr><td>%s-%d</td><td>%s</td><td>%d</td><td>%.3f</td>'\
+				'<td>%.3f</td><td>%.3f</td></tr>\n' % (proc, pid, name, f['calls'],
+				f['total']*1000, f['total']*1000/f['calls'], f['max']*1000))
+		hf.write('</table>\n')
 
-	tracer = ""
-	cg = aslib.FTraceCallGraph(0)
-	cg.stamp = ''
+# Function: flushCallgraph
+# Description:
+#	 Finish a completed callgraph, write it to the html output as a
+#	 collapsed top line with its body in a compressed blob, and add it to
+#	 the summary. The callgraph can be freed once this returns.
+# Arguments:
+#	 hf: the open html file
+#	 stats: the CallgraphSummary
+#	 key: the (process, pid) the callgraph belongs to
+#	 cg: the FTraceCallGraph
+#	 tZero: the time of the first trace line
+#	 num: the next html callgraph number
+# Output:
+#	 The next html callgraph number
+def flushCallgraph(hf, stats, key, cg, tZero, num):
+	proc, pid = key
+	if cg.invalid:
+		stats.dropped += 1
+		return num
+	if len(cg.list) < 1:
+		return num
+	if(not cg.postProcess()):
+		print('Sanity check failed for %s-%d' % (proc, pid))
+		return num
+	if cg.end - cg.start <= 0 or (funcfilter and cg.name != funcfilter):
+		return num
+	# normalize time to start of first line
+	cg.start -= tZero
+	cg.end -= tZero
+	for line in cg.list:
+		line.time -= tZero
+	cgid = ''
+	if (cg.end - cg.start) * 1000 >= sysvals.mincglen:
+		cgid = 'cg%d' % num
+		title = '%s-%d &rarr; %s' % (proc, pid, cg.name)
+		if cg.partial:
+			title += ' (partial)'
+		num = aslib.callgraphHTML(sysvals, hf, num, cg, title, '#FFFFCC', cgid)
+	stats.add(proc, pid, cg, cgid)
+	return num
+
+# Function: analyzeTraceLog
+# Description:
+#	 Stream a function_graph ftrace log into the html output. Each
+#	 process has one open callgraph built with the shared FTraceCallGraph
+#	 parser, which is written out and freed as soon as its top level call
+#	 returns, so memory is bounded by the number of processes and the
+#	 maxlines limit on a single callgraph rather than by the trace size.
+# Arguments:
+#	 file: the ftrace log
+#	 hf: the open html file, with its header already written
+# Output:
+#	 The CallgraphSummary of all the callgraphs
+def analyzeTraceLog(file, hf):
+	stats = CallgraphSummary()
+	ftemp = dict()
 	tZero = -1.0
+	num = 0
 
 	# read through the ftrace and parse the data
 	print("Analyzing the ftrace data...")
-	ttypefmt = r"# tracer: (?P<t>.*)"
-	stampfmt = r"# (?P<name>.*)-(?P<m>[0-9]{2})(?P<d>[0-9]{2})(?P<y>[0-9]{2})-"+\
-				"(?P<H>[0-9]{2})(?P<M>[0-9]{2})(?P<S>[0-9]{2})$"
-	linefmt = r"^ *(?P<time>[0-9\.]*) *\| *(?P<cpu>[0-9]*)\)"+\
-		" *(?P<proc>.*)-(?P<pid>[0-9]*) *\|"+\
-		"[ +!]*(?P<dur>[0-9\.]*) .*\|  (?P<msg>.*)"
+	ttypefmt = re.compile(r"# tracer: (?P<t>.*)")
+	stampfmt = re.compile(r"# (?P<name>.*)-(?P<m>[0-9]{2})(?P<d>[0-9]{2})(?P<y>[0-9]{2})-"+\
+				"(?P<H>[0-9]{2})(?P<M>[0-9]{2})(?P<S>[0-9]{2})$")
+	tp = aslib.TestProps()
+	tp.setTracerType('function_graph')
+	linefmt = re.compile(tp.ftrace_line_fmt)
 
-	# extract the callgraph and traceevent data
+	# extract the callgraph data a line at a time
+	hf.write('<section id="callgraphs" class="callgraph">\n')
 	tf = open(file, 'r')
 	for line in tf:
 		# remove any latent carriage returns
-		line = line.replace("\r\n", "")
-		# grab the time stamp first (signifies the start of the test run)
-		m = re.match(stampfmt, line)
-		if(m):
-			dt = datetime.datetime(int(m.group("y"))+2000, int(m.group("m")),
-				int(m.group("d")), int(m.group("H")), int(m.group("M")),
-				int(m.group("S")))
-			cg.stamp = dt.strftime("%B %d %Y, %I:%M:%S %p")
-			if(m.group("name")):
-				cg.stamp = m.group("name")+" "+cg.stamp
-			print cg.stamp
+		line = line.replace("\r\n", "").strip()
+		if not line:
 			continue
-		# determine the trace data type (required for further parsing)
-		m = re.match(ttypefmt, line)
-		if(m):
-			tracer = m.group("t")
-			if(tracer != "function_graph"):
-				print("Invalid tracer type: %s" % tracer)
-				sys.exit()
+		if line[0] == '#':
+			# grab the time stamp first (signifies the start of the test run)
+			m = stampfmt.match(line)
+			if(m):
+				dt = datetime.datetime(int(m.group("y"))+2000, int(m.group("m")),
+					int(m.group("d")), int(m.group("H")), int(m.group("M")),
+					int(m.group("S")))
+				stamp = dt.strftime("%B %d %Y, %I:%M:%S %p")
+				if(m.group("name")):
+					stamp = m.group("name")+" "+stamp
+				print stamp
+				hf.write('<div class="stamp">'+stamp+'</div>\n')
+				continue
+			# determine the trace data type (required for further parsing)
+			m = ttypefmt.match(line)
+			if(m and m.group("t") != "function_graph"):
+				doError("Invalid tracer type: %s" % m.group("t"))
 			continue
 		# parse only valid lines, if this isn't one move on
-		m = re.match(linefmt, line)
+		m = linefmt.match(line)
 		if(not m):
 			continue
 		# gather the basic message data from the line
-		m_time = m.group("time")
-		m_pid = m.group("pid")
-		m_msg = m.group("msg")
-		m_param3 = m.group("dur")
-		if(m_time and m_pid and m_msg):
-			t = aslib.FTraceLine(m_time, m_msg, m_param3)
-			pid = int(m_pid)
-			if(tZero < 0):
-				tZero = t.time
-		else:
+		m_time, m_proc, m_pid, m_msg, m_dur = \
+			m.group('time', 'proc', 'pid', 'msg', 'dur')
+		if(not m_time or not m_pid or not m_msg):
 			continue
-		# the line should be a call, return, or event
-		if(not t.fcall and not t.freturn and not t.fevent):
+		pid = int(m_pid)
+		if pidfilter >= 0 and pid != pidfilter:
 			continue
-		cg.addLine(t, m)
+		t = aslib.FTraceLine(m_time, m_msg, m_dur)
+		if(tZero < 0):
+			tZero = t.time
+		# only calls and returns make up the callgraph
+		if t.fevent or t.fkprobe:
+			continue
+		key = (m_proc.strip(), pid)
+		if(key not in ftemp):
+			ftemp[key] = aslib.FTraceCallGraph(pid, sysvals)
+		cg = ftemp[key]
+		res = cg.addLine(t)
+		if(res == 0):
+			if not cg.invalid and len(cg.list) > maxlines:
+				cg.invalidate(t)
+			continue
+		num = flushCallgraph(hf, stats, key, cg, tZero, num)
+		ftemp[key] = aslib.FTraceCallGraph(pid, sysvals)
+		if(res == -1):
+			ftemp[key].addLine(t)
 	tf.close()
 
-	# normalize time to start of first line
-	cg.start -= tZero
-	cg.end -= tZero
-	for line in cg.list:
-		line.time -= tZero
-
-	return cg
+	# the trace ended inside these, write what was caught
+	for key in sorted(ftemp):
+		num = flushCallgraph(hf, stats, key, ftemp[key], tZero, num)
+	hf.write('\n\n    </section>\n')
+	return stats
 
-# Function: createHTML
+# Function: createHTMLHeader
 # Description:
-#	 Create the output html file.
-def createHTML(cg, file):
-
-	hf = open(file, 'w')
-
+#	 Write the html header, the css, and the script which inflates each
+#	 callgraph body the first time it's expanded.
+def createHTMLHeader(hf):
 	# write the html header first (html head, css code, everything up to the start of body)
 	html_header = "<!DOCTYPE html>\n<html>\n<head>\n\
 	<meta http-equiv=\"content-type\" content=\"text/html; charset=UTF-8\">\n\
 	<title>AnalyzeSuspend</title>\n\
 	<style type='text/css'>\n\
-		body {overflow-y: scroll;}\n\
-		.stamp {width: 100%;text-align:center;background-color:gray;line-height:30px;color:white;font: 25px Arial;}\n\
+		body {overflow-y: scroll;display: flex;flex-direction: column;}\n\
+		.stamp {width: 100%;text-align:center;background-color:gray;line-height:30px;color:white;font: 25px Arial;order: -2;}\n\
 		.callgraph {margin-top: 30px;box-shadow: 5px 5px 20px black;}\n\
 		.callgraph article * {padding-left: 28px;}\n\
+		.summary {order: -1;margin-top: 30px;border-collapse: collapse;font: 15px Tahoma;}\n\
+		.summary td, .summary th {border: 1px solid black;padding: 2px 8px;}\n\
+		.summary td {text-align: right;}\n\
+		.summary td:nth-child(-n+2) {text-align: left;}\n\
 		h1 {color:black;font: bold 30px Times;}\n\
 		r {color:#500000;font:15px Tahoma;}\n\
 		n {color:#505050;font:15px Tahoma;}\n\
@@ -131,42 +233,42 @@ def createHTML(cg, file):
 		.pf:checked + label {background: url(\'data:image/svg+xml;utf,<?xml version=\"1.0\" standalone=\"no\"?><svg xmlns=\"http://www.w3.org/2000/svg\" height=\"18\" width=\"18\" version=\"1.1\"><circle cx=\"9\" cy=\"9\" r=\"8\" stroke=\"black\" stroke-width=\"1\" fill=\"white\"/><rect x=\"4\" y=\"8\" width=\"10\" height=\"2\" style=\"fill:black;stroke-width:0\"/><rect x=\"8\" y=\"4\" width=\"2\" height=\"10\" style=\"fill:black;stroke-width:0\"/></svg>\') no-repeat left center;}\n\
 		.pf:not(:checked) ~ label {background: url(\'data:image/svg+xml;utf,<?xml version=\"1.0\" standalone=\"no\"?><svg xmlns=\"http://www.w3.org/2000/svg\" height=\"18\" width=\"18\" version=\"1.1\"><circle cx=\"9\" cy=\"9\" r=\"8\" stroke=\"black\" stroke-width=\"1\" fill=\"white\"/><rect x=\"4\" y=\"8\" width=\"10\" height=\"2\" style=\"fill:black;stroke-width:0\"/></svg>\') no-repeat left center;}\n\
 		.pf:checked ~ *:not(:nth-child(2)) {display: none;}\n\
-	</style>\n</head>\n<body>\n"
+	</style>\n\
+	<script type=\"text/javascript\">\n\
+	function inflate(b64) {\n\
+		var bin = atob(b64);\n\
+		var buf = new Uint8Array(bin.length);\n\
+		for(var i = 0; i < bin.length; i++)\n\
+			buf[i] = bin.charCodeAt(i);\n\
+		var ds = new Response(buf).body.pipeThrough(new DecompressionStream(\"deflate\"));\n\
+		return new Response(ds).text();\n\
+	}\n\
+	function cgToggle() {\n\
+		var z = this.parentNode.getElementsByClassName(\"cgz\");\n\
+		if(z.length < 1) return;\n\
+		var blob = z[0];\n\
+		blob.className = \"hide\";\n\
+		inflate(blob.textContent).then(function(html) {blob.outerHTML = html;});\n\
+	}\n\
+	window.addEventListener(\"load\", function () {\n\
+		var cgz = document.getElementsByClassName(\"cgz\");\n\
+		for (var i = 0; i < cgz.length; i++)\n\
+			cgz[i].parentNode.getElementsByClassName(\"pf\")[0].onchange = cgToggle;\n\
+	});\n\
+	</script>\n</head>\n<body>\n"
 	hf.write(html_header)
 
-	hf.write('<div class="stamp">'+cg.stamp+'</div>\n')
-	# write the ftrace data (callgraph)
-	hf.write('<section id="callgraphs" class="callgraph">\n')
-	# write out the ftrace data converted to html
-	html_func_top = '<article id="{0}" class="atop" style="background-color:{1}">\n<input type="checkbox" class="pf" id="f{2}" checked/><label for="f{2}">{3} {4}</label>\n'
-	html_func_start = '<article>\n<input type="checkbox" class="pf" id="f{0}" checked/><label for="f{0}">{1} {2}</label>\n'
-	html_func_end = '</article>\n'
-	html_func_leaf = '<article>{0} {1}</article>\n'
-	num = 0
-	flen = "<r>(%.3f ms, from %.3f to %.3f)</r>" % ((cg.end - cg.start)*1000, cg.start*1000, cg.end*1000)
-	hf.write(html_func_top.format("rootnode", "#FFFFCC", num, "ftrace callgraph", flen))
-	num += 1
-	for line in cg.list:
-		if(line.length < 0.000000001):
-			flen = "<n>(<1us @ %.3f)</n>" % (line.time*1000)
-		else:
-			flen = "<n>(%.3f ms @ %.3f)</n>" % (line.length*1000, line.time*1000)
-		if(line.freturn and line.fcall):
-			hf.write(html_func_leaf.format(line.name, flen))
-		elif(line.freturn):
-			hf.write(html_func_end)
-		else:
-			hf.write(html_func_start.format(num, line.name, flen))
-			num += 1
-	hf.write(html_func_end)
-	hf.write("\n\n    </section>\n")
-	hf.write("</body>\n</html>\n")
-	hf.close()
-	return True
-
 def printHelp():
 	print("Convert ftrace callgraph into html")
-	print("Usage: ftrace.py tracefile")
+	print("Usage: ftrace.py <options> tracefile")
+	print("Options:")
+	print("  -o file        html output file (default: tracefile with .html)")
+	print("  -pid N         only graph the calls of this pid")
+	print("  -func name     only graph the top level calls of this function")
+	print("  -mincg ms      only write callgraphs this long, shorter ones are")
+	print("                 still counted in the summary (default: 0)")
+	print("  -maxdepth N    limit the callgraph depth to N (default: 0=all)")
+	print("  -maxlines N    drop any callgraph longer than N lines (default: 100000)")
 	return True
 
 def doError(msg, help=False):
@@ -176,17 +278,52 @@ def doError(msg, help=False):
 	sys.exit()
 
 if __name__ == '__main__':
-	if len(sys.argv) < 2:
+	file = ''
+	htmlfile = ''
+	args = iter(sys.argv[1:])
+	for arg in args:
+		if(arg == '-h'):
+			printHelp()
+			sys.exit()
+		elif(arg == '-o'):
+			try:
+				htmlfile = args.next()
+			except:
+				doError('No html filename supplied', True)
+		elif(arg == '-pid'):
+			pidfilter = aslib.getArgInt('-pid', args, 0, 4194304)
+		elif(arg == '-func'):
+			try:
+				funcfilter = args.next()
+			except:
+				doError('No function name supplied', True)
+		elif(arg == '-mincg'):
+			sysvals.mincglen = aslib.getArgFloat('-mincg', args, 0.0, 10000.0)
+		elif(arg == '-maxdepth'):
+			sysvals.max_graph_depth = aslib.getArgInt('-maxdepth', args, 0, 1000)
+		elif(arg == '-maxlines'):
+			maxlines = aslib.getArgInt('-maxlines', args, 1, 1000000000)
+		elif(arg[0] == '-' or file):
+			doError('Invalid argument: '+arg, True)
+		else:
+			file = arg
+
+	if not file:
 		printHelp()
 		sys.exit()
-
-	file = sys.argv[1]
 	if not os.path.exists(file):
 		doError('File not found')
 
-	m = re.match(r"(?P<name>.*)\.txt$", file)
-	htmlfile = "output.html"
-	if(m):
-		htmlfile = m.group("name")+".html"
-	cg = analyzeTraceLog(file)
-	createHTML(cg, htmlfile)
+	if not htmlfile:
+		m = re.match(r"(?P<name>.*)\.txt$", file)
+		htmlfile = "output.html"
+		if(m):
+			htmlfile = m.group("name")+".html"
+	hf = open(htmlfile, 'w')
+	createHTMLHeader(hf)
+	stats = analyzeTraceLog(file, hf)
+	stats.html(hf)
+	hf.write("</body>\n</html>\n")
+	hf.close()
+	print('%d callgraphs written, %d dropped, to %s' % \
+		(stats.written, stats.dropped, htmlfile))